@@ -0,0 +1,175 @@
+import argparse
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import logging
+from pathlib import Path
+
+import requests
+
+from data_2_dasch import (
+    PREFIX,
+    PROJECT_SHORT_CODE,
+    INGEST_HOST,
+    DSP_USER,
+    DSP_PWD,
+    CHECKSUM_FILE,
+    TokenCache,
+    bootstrap,
+    construct_payload,
+    create_resource,
+    fetch_collection,
+    find_resource_iri,
+    report_violations,
+    resolve_item_sets,
+    specify_mediaclass,
+    sync_object,
+)
+from event_log import setup_logging
+from data_model import validate_payload
+from http_session import session
+from media_checksums import record_checksum
+from process_data_from_omeka import extract_property
+from sync_journal import SyncJournal
+from xml_export import stage_media, staged_filename
+
+MAPPING_FIELDS = ["filename", "identifier", "omeka_id", "media_class", "sha256"]
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Stages the Omeka media for the bulk ingest of the DSP ingest service")
+    parser.add_argument("command", choices=["stage", "create"],
+                        help="'stage' downloads the media originals into the import directory, "
+                             "'create' creates the media resources from the result mapping of the bulk ingest")
+    parser.add_argument("--dir", default="bulk-ingest", help="root of the import directory; the files are staged in <dir>/<shortcode>")
+    parser.add_argument("--mapping", default="data_2_dasch.bulk.mapping.csv", help="mapping of the staged filenames to the Omeka media identifiers")
+    parser.add_argument("--result", default=None,
+                        help="mapping.csv of the finished bulk ingest (default: fetched from the ingest service)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of concurrent downloads")
+    parser.add_argument("--item-sets", type=str, default=None,
+                        help="comma-separated item set IDs or 'all' (all item sets of the site) that make up the collection (default: ITEM_SET_ID)")
+    parser.add_argument("--site-id", type=str, default=None, help="restricts '--item-sets all' to the item sets of this Omeka site")
+    return parser.parse_args()
+
+
+def media_class_of(media: dict) -> str:
+    return specify_mediaclass(extract_property(media.get("dcterms:format", []), 9))
+
+
+def stage_verified(media: dict, media_class: str, import_dir: Path) -> bool:
+    try:
+        return stage_media(media, media_class, import_dir)
+    except requests.exceptions.RequestException:
+        # already logged by download_file
+        return False
+
+
+def stage(media: list, import_dir: Path, workers: int) -> list:
+    """Downloads the originals of the media concurrently into the import directory.
+
+    Returns:
+        list: the mapping rows of the staged media
+    """
+    staged = {}
+    for entry in media:
+        media_class = media_class_of(entry)
+        filename = staged_filename(entry, media_class)
+        identifier = extract_property(entry.get("dcterms:identifier", []), 10)
+        if filename in staged:
+            logging.warning(f"{identifier}: file {filename} is already staged for {staged[filename][1]['identifier']}, skipping")
+            continue
+        staged[filename] = (entry, {"filename": filename, "identifier": identifier, "omeka_id": entry.get("o:id"),
+                                    "media_class": media_class, "sha256": entry.get("o:sha256")})
+
+    import_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        verified = list(executor.map(lambda entry: stage_verified(entry[0], entry[1]["media_class"], import_dir), staged.values()))
+    return [row for (entry, row), ok in zip(staged.values(), verified) if ok]
+
+
+def write_mapping(path: str, rows: list) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as mapping_file:
+        writer = csv.DictWriter(mapping_file, fieldnames=MAPPING_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_mapping(path: str) -> dict:
+    """Returns the staged filename by Omeka media identifier."""
+    with open(path, encoding="utf-8", newline="") as mapping_file:
+        return {row["identifier"]: row["filename"] for row in csv.DictReader(mapping_file)}
+
+
+def fetch_result(token: str) -> str:
+    """Fetches the mapping of the original filenames to the internal filenames of the last bulk ingest."""
+    endpoint = f"{INGEST_HOST}/projects/{PROJECT_SHORT_CODE}/bulk-ingest/mapping.csv"
+    response = session.get(endpoint, headers={"Authorization": f"Bearer {token}"}, timeout=30)
+    response.raise_for_status()
+    return response.text
+
+
+def parse_result(text: str) -> dict:
+    """Returns the internal filename by original filename (relative to the import directory)."""
+    return {Path(row["original"]).as_posix(): row["derivative"] for row in csv.DictReader(io.StringIO(text))}
+
+
+def create_media(tokens: TokenCache, items: list, media: list, staged: dict, internal_filenames: dict, context: dict,
+                 journal: SyncJournal) -> None:
+    """Creates the sgb_MEDIA_* resources of the ingested files, after syncing the objects they belong to."""
+    parent_ids = {}
+    for item in items:
+        sync_object(tokens.get(), item, context, journal)
+        parent_ids[item.get("o:id")] = extract_property(item.get("dcterms:identifier", []), 10)
+
+    for entry in media:
+        media_id = extract_property(entry.get("dcterms:identifier", []), 10)
+        media_class = media_class_of(entry)
+        token = tokens.get()
+        internal_filename = internal_filenames.get(staged.get(media_id))
+        if not internal_filename:
+            logging.error(f"{media_id}: file was not staged or not ingested")
+            journal.record("media", media_id, "failed", entry.get("o:id"))
+            continue
+        if find_resource_iri(token, media_class, media_id, context["iri_cache"]):
+            logging.info(f"{media_id}: media exists already")
+            journal.record("media", media_id, "unchanged", entry.get("o:id"))
+            continue
+        parent_iri = find_resource_iri(token, f"{PREFIX}sgb_OBJECT", parent_ids.get(entry.get("o:item", {}).get("o:id"), ""), context["iri_cache"])
+        payload = construct_payload(entry, media_class, context["project_iri"], context["project_lists"], parent_iri, internal_filename)
+        violations = validate_payload(context["data_model"], payload, PREFIX)
+        if violations:
+            report_violations(journal, "media", media_id, entry.get("o:id"), violations)
+            continue
+        created = create_resource(payload, token)
+        journal.record("media", media_id, "created" if created else "failed", entry.get("o:id"), internal_filename=internal_filename)
+        if created:
+            record_checksum(CHECKSUM_FILE, context["checksums"], media_id, entry, internal_filename)
+
+
+def main() -> None:
+    args = parse_arguments()
+    setup_logging("data_2_dasch.bulk")
+
+    items, media = fetch_collection(resolve_item_sets(args.item_sets, args.site_id))
+
+    if args.command == "stage":
+        rows = stage(media, Path(args.dir) / PROJECT_SHORT_CODE, args.workers)
+        write_mapping(args.mapping, rows)
+        logging.info(f"Staged {len(rows)} of {len(media)} media files in {Path(args.dir) / PROJECT_SHORT_CODE}, mapping written to {args.mapping}")
+        return
+
+    tokens = TokenCache(DSP_USER, DSP_PWD)
+    if args.result:
+        with open(args.result, encoding="utf-8") as result_file:
+            internal_filenames = parse_result(result_file.read())
+    else:
+        internal_filenames = parse_result(fetch_result(tokens.get()))
+    context = bootstrap()
+    journal = SyncJournal("data_2_dasch.bulk.journal.jsonl", "data_2_dasch.bulk.metrics.json", items=len(items))
+    create_media(tokens, items, media, read_mapping(args.mapping), internal_filenames, context, journal)
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
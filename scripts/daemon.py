@@ -0,0 +1,201 @@
+import argparse
+from argparse import Namespace
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from data_2_dasch import (
+    ITEM_SET_ID,
+    DSP_USER,
+    DSP_PWD,
+    TokenCache,
+    bootstrap,
+    sync_item,
+)
+from event_log import item_events, setup_logging
+from process_data_from_omeka import (
+    extract_property,
+    get_modified_since,
+    get_item,
+    get_item_by_identifier
+)
+from sync_journal import SyncJournal
+
+STATE_FILE = os.getenv("DAEMON_STATE_FILE", "data_2_dasch.daemon.json")
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Keeps the DSP in sync with Omeka by polling for modified items")
+    parser.add_argument("-i", "--interval", type=int, default=60, help="seconds between two polls of Omeka")
+    parser.add_argument("--since", type=str, default=None,
+                        help="sync the items modified after this ISO timestamp in the first cycle (default: end of the last cycle)")
+    parser.add_argument("--overlap", type=int, default=60,
+                        help="seconds each poll reaches back before the last cycle, to tolerate clock differences")
+    parser.add_argument("-p", "--port", type=int, default=None,
+                        help="start a local HTTP trigger on this port: POST /sync/<o:id or identifier> syncs one item at once")
+    return parser.parse_args()
+
+
+def in_item_set(item: dict, item_set_id: str) -> bool:
+    return any(str(item_set.get("o:id")) == str(item_set_id) for item_set in item.get("o:item_set", []))
+
+
+def modified_items(item_set_id: str, since: str) -> tuple[list, set]:
+    """Returns the items modified after `since`, including the items whose media were modified.
+
+    Returns:
+        tuple[list, set]: the items and the Omeka IDs of the items that could not be fetched
+    """
+    items = {item["o:id"]: item for item in get_modified_since("items", item_set_id, since)}
+    unfetched = set()
+    for media in get_modified_since("media", item_set_id, since):
+        parent_id = media.get("o:item", {}).get("o:id")
+        if parent_id is not None and parent_id not in items and parent_id not in unfetched:
+            item = get_item(parent_id)
+            if item is None:
+                unfetched.add(parent_id)
+            elif in_item_set(item, item_set_id):
+                items[parent_id] = item
+    return list(items.values()), unfetched
+
+
+def retry_items(item_ids: set, item_set_id: str) -> tuple[list, set]:
+    """Fetches the items that failed in earlier cycles.
+
+    Returns:
+        tuple[list, set]: the items and the Omeka IDs of the items that could not be fetched
+    """
+    items = []
+    unfetched = set()
+    for item_id in sorted(item_ids):
+        item = get_item(item_id)
+        if item is None:
+            unfetched.add(item_id)
+        elif in_item_set(item, item_set_id):
+            items.append(item)
+    return items, unfetched
+
+
+def failed_count(journal: SyncJournal) -> int:
+    return sum(number for (kind, action), number in journal.counts.items() if action == "failed")
+
+
+def load_state() -> dict:
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, encoding="utf-8") as state_file:
+        return json.load(state_file)
+
+
+def save_state(state: dict) -> None:
+    with open(STATE_FILE, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=4)
+
+
+def start_trigger_server(port: int, triggers: queue.Queue) -> ThreadingHTTPServer:
+    """Starts a local HTTP server that queues the items posted to /sync/<o:id or identifier>."""
+
+    class TriggerHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            prefix = "/sync/"
+            if not self.path.startswith(prefix) or len(self.path) == len(prefix):
+                self.send_error(404, "use POST /sync/<o:id or identifier>")
+                return
+            triggers.put(self.path[len(prefix):])
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logging.info(f"Trigger: {format % args}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), TriggerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Listening for sync triggers on http://127.0.0.1:{port}/sync/<o:id or identifier>")
+    return server
+
+
+def run_sync(tokens: TokenCache, item: dict, context: dict, journal: SyncJournal) -> bool:
+    """Syncs one item; returns False if it raised or recorded a failed object or media."""
+    failures = failed_count(journal)
+    try:
+        with item_events("item", extract_property(item.get("dcterms:identifier", []), 10), item.get("o:id")):
+            sync_item(tokens.get(), item, context, journal)
+    except Exception:
+        # e.g. a cached IRI of a resource that was deleted in the meantime
+        logging.exception(f"Sync of item {item.get('o:id')} failed, clearing the IRI cache")
+        context["iri_cache"].clear()
+        return False
+    return failed_count(journal) == failures
+
+
+def main() -> None:
+    args = parse_arguments()
+    setup_logging("data_2_dasch.daemon")
+    state = load_state()
+    since = args.since or state.get("last_cycle") or datetime.now(timezone.utc).isoformat(timespec="seconds")
+    # items whose sync failed are retried in the next cycles
+    failed = set(state.get("failed", []))
+
+    tokens = TokenCache(DSP_USER, DSP_PWD)
+    context = bootstrap()
+    journal = SyncJournal("data_2_dasch.daemon.journal.jsonl", "data_2_dasch.daemon.metrics.json")
+    triggers = queue.Queue()
+    server = start_trigger_server(args.port, triggers) if args.port else None
+
+    try:
+        while True:
+            cycle_start = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            poll_since = (datetime.fromisoformat(since) - timedelta(seconds=args.overlap)).isoformat(timespec="seconds")
+            try:
+                items, unfetched = modified_items(ITEM_SET_ID, poll_since)
+            except requests.exceptions.RequestException:
+                # keep the cursor, so the next cycle polls the same window again
+                logging.error(f"Polling Omeka failed, polling again from {poll_since} in the next cycle")
+                items = None
+            if items is not None:
+                logging.info(f"{len(items)} items modified since {poll_since}")
+                polled = {item["o:id"] for item in items}
+                retried, still_unfetched = retry_items(failed - polled - unfetched, ITEM_SET_ID)
+                # their DSP resources may be newer than the Omeka items after a partly failed update
+                context["recheck"] = set(failed)
+                if retried:
+                    logging.info(f"Retrying {len(retried)} items that failed in earlier cycles")
+                failed = unfetched | still_unfetched
+                for item in items + retried:
+                    if not run_sync(tokens, item, context, journal):
+                        failed.add(item["o:id"])
+                since = cycle_start
+            save_state({"last_cycle": since, "failed": sorted(failed)})
+            journal.write_metrics()
+
+            # wait for the next cycle, syncing triggered items right away
+            deadline = time.monotonic() + args.interval
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    trigger = triggers.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                item = get_item(trigger) if trigger.isdigit() else get_item_by_identifier(trigger)
+                if item is None or not in_item_set(item, ITEM_SET_ID):
+                    logging.warning(f"Triggered item '{trigger}' not found in item set {ITEM_SET_ID}")
+                    continue
+                if not run_sync(tokens, item, context, journal):
+                    failed.add(item["o:id"])
+                    save_state({"last_cycle": since, "failed": sorted(failed)})
+    except KeyboardInterrupt:
+        logging.info("Stopping daemon")
+    finally:
+        if server:
+            server.shutdown()
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
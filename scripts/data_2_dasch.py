@@ -1,22 +1,37 @@
 import argparse
 from argparse import Namespace
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+import json
 import logging
 import os
 from pathlib import Path
 import random
 import tempfile
+import threading
+import time
 from typing import cast
 import urllib
 import zipfile
 
 import requests
 
+from http_session import session
 from process_data_from_omeka import (
     get_items_from_collection,
+    get_item_sets,
     get_media,
+    get_media_from_collection,
     extract_combined_values,
     extract_property
 )
+from data_model import load_data_model, register_list_iris, validate_changes, validate_payload
+from event_log import item_events, log_event, setup_logging
+from media_checksums import file_changed, load_checksums, record_checksum
+from scheduler import PRIORITIES, Deadline, load_pending, parse_priorities, plan_tasks, save_pending, splits_media
+from sharding import claim_identifiers, duplicate_media, parse_shard, shard_of, shard_suffix
+from sync_journal import SyncJournal
 
 # TODO: - improve error handling
 #       - improve logging
@@ -32,20 +47,19 @@ DSP_USER = os.getenv("DSP_USER")
 DSP_PWD = os.getenv("DSP_PWD")
 PREFIX = os.getenv("PREFIX", "StadtGeschichteBasel_v1:")
 
+CHECKSUM_FILE = os.getenv("CHECKSUM_FILE", "data_2_dasch.checksums.jsonl")
+
+# File value type of each media class
+FILE_VALUE_TYPES = {
+    f"{PREFIX}sgb_MEDIA_IMAGE": "StillImageFileValue",
+    f"{PREFIX}sgb_MEDIA_DOCUMENT": "DocumentFileValue",
+    f"{PREFIX}sgb_MEDIA_TEXT": "TextFileValue",
+    f"{PREFIX}sgb_MEDIA_ARCHIV": "ArchiveFileValue",
+}
+
 NUMBER_RANDOM_OBJECTS = 2
 TEST_DATA = {'abb13025', 'abb14375', 'abb41033', 'abb11536', 'abb28998'}
 
-# Set up logging
-file_handler = logging.FileHandler("data_2_dasch.log", mode='w')
-file_handler.setLevel(logging.INFO)
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[stream_handler, file_handler]
-)
-
 
 def parse_arguments() -> Namespace:
     """Parses the commandline for the path to the config-file and for the path to the output directory.
@@ -57,6 +71,16 @@ def parse_arguments() -> Namespace:
     parser = argparse.ArgumentParser(description="--mode")
     parser.add_argument("-m", "--mode", type=str, choices=['all_data', 'sample_data', 'test_data'], default='all_data',
                         help=f"which data should be processed? possible options: 'all_data' (all data), 'sample_data' ({NUMBER_RANDOM_OBJECTS} random metadata objects),'test_data' (10 selected test metadata objects)")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="k/N",
+                        help="process only the items of shard k out of N (e.g. 1/4); media follow their parent item")
+    parser.add_argument("--item-sets", type=str, default=None,
+                        help="comma-separated item set IDs or 'all' (all item sets of the site) synced in one run (default: ITEM_SET_ID)")
+    parser.add_argument("--site-id", type=str, default=None, help="restricts '--item-sets all' to the item sets of this Omeka site")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of items synced concurrently")
+    parser.add_argument("--time-budget", type=float, default=None, metavar="SECONDS",
+                        help="stop starting new work after this many seconds; what is left is synced first by the next run")
+    parser.add_argument("--priority", type=parse_priorities, default=[],
+                        help=f"comma-separated order of the work, the first weighs most: {', '.join(PRIORITIES)} (default: Omeka order)")
     args = parser.parse_args()
 
     return args
@@ -64,13 +88,43 @@ def parse_arguments() -> Namespace:
 
 def login(email: str, password: str) -> str:
     endpoint = f"{API_HOST}/v2/authentication"
-    response = requests.post(endpoint, json={"email": email, "password": password}, timeout=10)
+    response = session.post(endpoint, json={"email": email, "password": password}, timeout=10)
     logging.info("Login successful")
     return cast(str, response.json()["token"])
 
+def token_expiry(token: str) -> float | None:
+    """Returns the expiry (epoch seconds) of a JWT, or None if the token cannot be decoded."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+class TokenCache:
+    """Keeps the DSP token and logs in again shortly before it expires."""
+
+    def __init__(self, email: str, password: str, margin: int = 300, fallback_lifetime: int = 3600) -> None:
+        self.email = email
+        self.password = password
+        self.margin = margin
+        self.fallback_lifetime = fallback_lifetime
+        self._token = None
+        self._expiry = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token is None or time.time() > self._expiry - self.margin:
+                self._token = login(self.email, self.password)
+                self._expiry = token_expiry(self._token) or time.time() + self.fallback_lifetime
+            return self._token
+
+
 def get_project():
     endpoint = f"{API_HOST}/admin/projects/shortcode/{PROJECT_SHORT_CODE}"
-    response = requests.get(endpoint)
+    response = session.get(endpoint)
     if response.status_code == 200:
         logging.info(f"project Iri: {cast(str, response.json()["project"]["id"])}")
     else:
@@ -81,7 +135,7 @@ def get_project():
 # Get lists
 def get_lists(project_iri):
     url_lists = f"{API_HOST}/admin/lists/?projectIri={project_iri}"
-    response_lists = requests.get(url_lists)
+    response_lists = session.get(url_lists)
     if response_lists.status_code == 200:
         all_lists = []
         for list in response_lists.json()["lists"]:
@@ -90,7 +144,7 @@ def get_lists(project_iri):
             encoded_list_id = urllib.parse.quote(list_id, safe='')
             # Construct the API endpoint for this specific list ID
             url = f"{API_HOST}/v2/lists/{encoded_list_id}"
-            response = requests.get(url)
+            response = session.get(url)
             if response.status_code == 200:
                 all_lists.append(response.json())
             else:
@@ -108,7 +162,7 @@ def get_full_resource(token: str, resource_iri: str) -> dict:
     headers = {
         "Authorization": f"Bearer {token}"
     }
-    response = requests.get(endpoint, headers=headers)
+    response = session.get(endpoint, headers=headers)
     return response.json()
 
 def extract_dasch_propvalue(item, prop):
@@ -174,7 +228,7 @@ def get_resource_by_id(token: str, object_class: str, identifier: str) -> dict:
             FILTER(?identifier = "{identifier}")
         }}
         """
-    response = requests.post(endpoint, data=query.encode('utf-8'), headers=headers)
+    response = session.post(endpoint, data=query.encode('utf-8'), headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -183,6 +237,111 @@ def get_resource_by_id(token: str, object_class: str, identifier: str) -> dict:
         return {}
 
 
+def graph_entries(response_json: dict) -> list:
+    """Returns the resources of a JSON-LD response as a list (a single resource is not wrapped in '@graph')."""
+    if "@graph" in response_json:
+        return response_json["@graph"]
+    if "@id" in response_json:
+        return [response_json]
+    return []
+
+
+def gravsearch_pages(token: str, query: str):
+    """Runs a Gravsearch query page by page (the query must end with 'OFFSET {offset}') and yields the resources.
+
+    A failed page raises, as the callers would otherwise take a partial result for all resources.
+    """
+    endpoint = f"{API_HOST}/v2/searchextended"
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/sparql-query; charset=utf-8"
+    }
+    offset = 0
+    while True:
+        response = session.post(endpoint, data=query.format(offset=offset).encode('utf-8'), headers=headers, timeout=30)
+        if response.status_code != 200:
+            logging.error(f"Gravsearch query failed: {response.status_code}")
+            logging.error(response.text)
+            raise requests.exceptions.HTTPError(f"Gravsearch query failed: {response.status_code}", response=response)
+        result = response.json()
+        yield from graph_entries(result)
+        if not result.get("knora-api:mayHaveMoreResults"):
+            return
+        offset += 1
+
+
+def get_resources_of_class(token: str, object_class: str) -> dict:
+    """Fetches the identifiers of all resources of a class with paged Gravsearch queries.
+
+    Returns:
+        dict: resource IRI by identifier
+    """
+    query = f"""
+        PREFIX knora-api: <http://api.knora.org/ontology/knora-api/v2#>
+        PREFIX {PREFIX} <{API_HOST}/ontology/{PROJECT_SHORT_CODE}/StadtGeschichteBasel_v1/v2#>
+        CONSTRUCT {{{{
+            ?resource knora-api:isMainResource true .
+            ?resource {PREFIX}identifier ?identifierValue .
+        }}}} WHERE {{{{
+            ?resource a {object_class} .
+            ?resource {PREFIX}identifier ?identifierValue .
+        }}}}
+        OFFSET {{offset}}
+        """
+    resources = {}
+    for resource in gravsearch_pages(token, query):
+        resources[extract_dasch_propvalue(resource, "identifier")] = resource["@id"]
+    logging.info(f"Found {len(resources)} resources of {object_class}")
+    return resources
+
+
+def get_media_parents(token: str, media_class: str) -> dict:
+    """Fetches the parent objects of all media of a class with paged Gravsearch queries.
+
+    Returns:
+        dict: IRI of the linked sgb_OBJECT by media identifier
+    """
+    query = f"""
+        PREFIX knora-api: <http://api.knora.org/ontology/knora-api/v2#>
+        PREFIX {PREFIX} <{API_HOST}/ontology/{PROJECT_SHORT_CODE}/StadtGeschichteBasel_v1/v2#>
+        CONSTRUCT {{{{
+            ?resource knora-api:isMainResource true .
+            ?resource {PREFIX}identifier ?identifierValue .
+            ?resource {PREFIX}partOf_Metadata ?parent .
+        }}}} WHERE {{{{
+            ?resource a {media_class} .
+            ?resource {PREFIX}identifier ?identifierValue .
+            ?resource {PREFIX}partOf_Metadata ?parent .
+        }}}}
+        OFFSET {{offset}}
+        """
+    parents = {}
+    for resource in gravsearch_pages(token, query):
+        link = resource.get(f"{PREFIX}partOf_MetadataValue", {})
+        if isinstance(link, list):
+            link = link[0]
+        parent = link.get("knora-api:linkValueHasTarget", {}).get("@id") or link.get("knora-api:linkValueHasTargetIri", {}).get("@id")
+        parents[extract_dasch_propvalue(resource, "identifier")] = parent
+    return parents
+
+
+def get_full_resources(token: str, resource_iris: list, batch_size: int = 25) -> list:
+    """Fetches several full resources with one request per batch of IRIs."""
+    headers = {
+        "Authorization": f"Bearer {token}"
+    }
+    resources = []
+    for start in range(0, len(resource_iris), batch_size):
+        batch = resource_iris[start:start + batch_size]
+        path = "/".join(urllib.parse.quote(iri, safe='') for iri in batch)
+        response = session.get(f"{API_HOST}/v2/resources/{path}", headers=headers, timeout=60)
+        if response.status_code == 200:
+            resources.extend(graph_entries(response.json()))
+        else:
+            logging.error(f"Failed to retrieve resources: {response.status_code}: {response.text}")
+    return resources
+
+
 def update_value(token, item, value, field, field_type, type_of_change):
 
     context_data = {
@@ -229,7 +388,7 @@ def update_value(token, item, value, field, field_type, type_of_change):
                 "@value": value,
                 "@type": "http://www.w3.org/2001/XMLSchema#anyURI"
             }
-        if field_type == "linkvalue":
+        if field_type == "LinkValue":
             payload[f"{PREFIX}{field}"]["knora-api:linkValueHasTargetIri"] = {
                 "@id": value 
             }
@@ -243,16 +402,21 @@ def update_value(token, item, value, field, field_type, type_of_change):
         "X-Asset-Ingested": "true",
     }
 
+    identifier = item[f"{PREFIX}identifier"]["knora-api:valueAsString"]
+    started = time.monotonic()
     if type_of_change == "update":
-        response = requests.put(endpoint, json=payload, headers=headers, timeout=10)
+        response = session.put(endpoint, json=payload, headers=headers, timeout=10)
     else:
-        response = requests.post(endpoint, json=payload, headers=headers, timeout=10)
+        response = session.post(endpoint, json=payload, headers=headers, timeout=10)
 
     if response.status_code == 200:
-        logging.info(f"{item[f"{PREFIX}identifier"]["knora-api:valueAsString"]}: {type_of_change}d {field} '{value}'")
+        log_event("value", identifier, "ok", started, field=field, change=type_of_change)
+        return True
     else:
-        logging.error(f"{item[f"{PREFIX}identifier"]["knora-api:valueAsString"]}: update of {field} failed: {response.status_code}: {response.text}")
-        # logging.error(payload)
+        log_event("value", identifier, "failed", started, field=field, change=type_of_change,
+                  http_status=response.status_code, error=response.text[:500])
+        logging.error(f"{identifier}: {type_of_change} of {field} failed: {response.status_code}")
+        return False
 
 def arrays_equal(array1, array2):
     if len(array1) != len(array2):
@@ -289,11 +453,11 @@ def check_values(dasch_item, omeka_item, lists):
     if description: modified_values.append(description)
     subjects = []
     for data in extract_combined_values(omeka_item.get("dcterms:subject", [])):
-        subject = extract_listvalueiri_from_value(data, "Thema", lists)
+        subject = resolve_list_value(data, "Thema", lists)
         subjects.append(subject)
     subject = sync_array_value("subject", "ListValue", extract_dasch_propvalue_multiple(dasch_item, "subject"), subjects)
     if subject: modified_values.extend(subject)
-    temporal = sync_value("temporal", "ListValue", extract_dasch_propvalue(dasch_item, "temporal"),extract_listvalueiri_from_value(extract_property(omeka_item.get("dcterms:temporal", []), 41), "Era", lists))
+    temporal = sync_value("temporal", "ListValue", extract_dasch_propvalue(dasch_item, "temporal"),resolve_list_value(extract_property(omeka_item.get("dcterms:temporal", []), 41), "Era", lists))
     if temporal: modified_values.append(temporal)
     language = sync_value("language", "TextValue", extract_dasch_propvalue(dasch_item, "language"),extract_property(omeka_item.get("dcterms:language", []), 12))
     if language: modified_values.append(language)
@@ -313,9 +477,9 @@ def check_values(dasch_item, omeka_item, lists):
         if date: modified_values.append(date)
         extent = sync_value("extent", "TextValue", extract_dasch_propvalue(dasch_item, "extent"),extract_property(omeka_item.get("dcterms:extent", []), 25))
         if extent: modified_values.append(extent)
-        type = sync_value("type", "ListValue", extract_dasch_propvalue(dasch_item, "type"),extract_listvalueiri_from_value(extract_property(omeka_item.get("dcterms:type", []), 8, only_label=True), "DCMI Type Vocabulary", lists))
+        type = sync_value("type", "ListValue", extract_dasch_propvalue(dasch_item, "type"),resolve_list_value(extract_property(omeka_item.get("dcterms:type", []), 8, only_label=True), "DCMI Type Vocabulary", lists))
         if type: modified_values.append(type)
-        format = sync_value("format", "ListValue", extract_dasch_propvalue(dasch_item, "format"),extract_listvalueiri_from_value(extract_property(omeka_item.get("dcterms:format", []), 9), "Internet Media Type", lists))
+        format = sync_value("format", "ListValue", extract_dasch_propvalue(dasch_item, "format"),resolve_list_value(extract_property(omeka_item.get("dcterms:format", []), 9), "Internet Media Type", lists))
         if format: modified_values.append(format)
         source = sync_array_value("source", "TextValue", extract_dasch_propvalue_multiple(dasch_item, "source"), extract_combined_values(omeka_item.get("dcterms:source", [])))
         if source: modified_values.extend(source)
@@ -332,12 +496,35 @@ def check_values(dasch_item, omeka_item, lists):
 def extract_listvalueiri_from_value(value, list_label, lists):
         reference = next((list for list in lists if list["rdfs:label"] == list_label), None)
         sublist = reference["knora-api:hasSubListNode"]
+        if isinstance(sublist, dict):
+            # a list with a single node
+            sublist = [sublist]
         match = next((node for node in sublist if node["rdfs:label"] == value), None)
         if match:
             return match["@id"]
         else:
             logging.warning(f"No match found for value: '{value}' in list: {list_label}")
 
+def resolve_list_value(value, list_label, lists):
+    """Returns the list node IRI of an Omeka label: '' if the label is empty, None if it is not in the list."""
+    if not value:
+        return ""
+    return extract_listvalueiri_from_value(value, list_label, lists)
+
+def list_value_entry(value, list_label, lists):
+    """Returns the ListValue of an Omeka label, None if the label is empty.
+
+    A label that is not in the list gives a value without node IRI (but with the label), which
+    the validation reports, instead of being left out silently.
+    """
+    iri = resolve_list_value(value, list_label, lists)
+    if iri == "":
+        return None
+    node = {"@id": iri}
+    if iri is None:
+        node["rdfs:label"] = value
+    return {"@type": "knora-api:ListValue", "knora-api:listValueAsListNode": node}
+
 def construct_payload(item, type, project_iri, lists, parent_iri, internalMediaFilename):
     context_data = {
         "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
@@ -370,23 +557,14 @@ def construct_payload(item, type, project_iri, lists, parent_iri, internalMediaF
     if 'dcterms:subject' in item:
         subjects = []
         for data in extract_combined_values(item.get("dcterms:subject", [])):
-            subject = extract_listvalueiri_from_value(data, "Thema", lists)
+            subject = list_value_entry(data, "Thema", lists)
             if subject:
-                subjects.append({
-                "@type": "knora-api:ListValue",
-                "knora-api:listValueAsListNode": {
-                    "@id": subject
-            }})
+                subjects.append(subject)
         payload[f"{PREFIX}subject"] = subjects
     if 'dcterms:temporal' in item:
-        temporal = extract_listvalueiri_from_value(extract_property(item.get("dcterms:temporal", []), 41), "Era", lists)
+        temporal = list_value_entry(extract_property(item.get("dcterms:temporal", []), 41), "Era", lists)
         if temporal:
-            payload[f"{PREFIX}temporal"] = {
-                "@type": "knora-api:ListValue",
-                "knora-api:listValueAsListNode": {
-                    "@id": temporal
-                }
-            }
+            payload[f"{PREFIX}temporal"] = temporal
     if extract_property(item.get("dcterms:language", []), 12):
         payload[f"{PREFIX}language"] =  {
             "knora-api:valueAsString": extract_property(item.get("dcterms:language", []), 12),
@@ -402,24 +580,9 @@ def construct_payload(item, type, project_iri, lists, parent_iri, internalMediaF
         payload[f"{PREFIX}isPartOf"] = isPartOf
          
     # Handle MEDIA type-specific fields
-    if type == f"{PREFIX}sgb_MEDIA_IMAGE":
-        payload["knora-api:hasStillImageFileValue"] =  {
-            "@type": "knora-api:StillImageFileValue",
-            "knora-api:fileValueHasFilename": internalMediaFilename
-        }
-    if type == f"{PREFIX}sgb_MEDIA_ARCHIV":
-        payload["knora-api:hasArchiveFileValue"] =  {
-            "@type": "knora-api:ArchiveFileValue",
-            "knora-api:fileValueHasFilename": internalMediaFilename
-        }
-    if type == f"{PREFIX}sgb_MEDIA_DOCUMENT":
-        payload["knora-api:hasDocumentFileValue"] =  {
-            "@type": "knora-api:DocumentFileValue",
-            "knora-api:fileValueHasFilename": internalMediaFilename
-        }
-    if type == f"{PREFIX}sgb_MEDIA_TEXT":
-        payload["knora-api:hasTextFileValue"] =  {
-            "@type": "knora-api:TextFileValue",
+    if type in FILE_VALUE_TYPES:
+        payload[f"knora-api:has{FILE_VALUE_TYPES[type]}"] =  {
+            "@type": f"knora-api:{FILE_VALUE_TYPES[type]}",
             "knora-api:fileValueHasFilename": internalMediaFilename
         }
     if type.startswith(f"{PREFIX}sgb_MEDIA"):
@@ -435,22 +598,12 @@ def construct_payload(item, type, project_iri, lists, parent_iri, internalMediaF
                 "knora-api:valueAsString": extract_property(item.get("dcterms:date", []), 7),
                 "@type": "knora-api:TextValue"
             }       
-        mediatype = extract_listvalueiri_from_value(extract_property(item.get("dcterms:type", []), 8, only_label=True), "DCMI Type Vocabulary", lists)
+        mediatype = list_value_entry(extract_property(item.get("dcterms:type", []), 8, only_label=True), "DCMI Type Vocabulary", lists)
         if mediatype:
-            payload[f"{PREFIX}type"] = {
-                "@type": "knora-api:ListValue",
-                "knora-api:listValueAsListNode": {
-                    "@id": mediatype
-                }
-            }
-        format = extract_listvalueiri_from_value(extract_property(item.get("dcterms:format", []), 9), "Internet Media Type", lists)
+            payload[f"{PREFIX}type"] = mediatype
+        format = list_value_entry(extract_property(item.get("dcterms:format", []), 9), "Internet Media Type", lists)
         if format:
-            payload[f"{PREFIX}format"] = {
-                "@type": "knora-api:ListValue",
-                "knora-api:listValueAsListNode": {
-                    "@id": format
-                }
-            }
+            payload[f"{PREFIX}format"] = format
         if 'dcterms:extent' in item:
             payload[f"{PREFIX}extent"] = {
                 "knora-api:valueAsString": extract_property(item.get("dcterms:extent", []), 25),
@@ -517,7 +670,7 @@ def upload_file_from_url(file_url: str, token: str, zip: bool = False) -> str:
     """
     # Download the file from the URL
     try:
-        response = requests.get(file_url, stream=True, timeout=10)
+        response = session.get(file_url, stream=True, timeout=10)
     except requests.exceptions.RequestException as err:
         logging.error(f"File download error: {err}")
         raise     
@@ -550,7 +703,7 @@ def upload_file_from_url(file_url: str, token: str, zip: bool = False) -> str:
     try:
         # Upload the file
         with open(temp_file_path, "rb") as file_data:
-            upload_response = requests.post(endpoint, data=file_data, headers=headers, timeout=30)
+            upload_response = session.post(endpoint, data=file_data, headers=headers, timeout=30)
         
         # Clean up the temporary file
         temp_file_path.unlink()
@@ -570,7 +723,7 @@ def upload_file_from_url(file_url: str, token: str, zip: bool = False) -> str:
     return None
 
 
-def create_resource(payload: dict, token: str) -> None:
+def create_resource(payload: dict, token: str) -> bool:
     # https://docs.dasch.swiss/latest/DSP-API/03-endpoints/api-v2/editing-resources/#creating-a-resource
     resources_endpoint = f"{API_HOST}/v2/resources"
     headers = {
@@ -578,12 +731,113 @@ def create_resource(payload: dict, token: str) -> None:
         "X-Asset-Ingested": "true",
     }
 
-    response = requests.post(resources_endpoint, json=payload, headers=headers, timeout=10)
+    identifier = payload[f"{PREFIX}identifier"]["knora-api:valueAsString"]
+    started = time.monotonic()
+    response = session.post(resources_endpoint, json=payload, headers=headers, timeout=10)
+    if response.status_code == 200:
+        log_event("resource", identifier, "ok", started, change="create", resource_class=payload["@type"])
+        logging.info(f"{identifier}: resource created on DaSCH")
+        return True
+    else:
+        log_event("resource", identifier, "failed", started, change="create", resource_class=payload["@type"],
+                  http_status=response.status_code, error=response.text[:500])
+        logging.error(f"{identifier}: resource creation failed: {response.status_code}")
+        return False
+
+
+def update_file_value(token: str, resource: dict, internal_filename: str) -> bool:
+    """Replaces the file of a media resource with a newly ingested file, keeping the resource and its values."""
+    # https://docs.dasch.swiss/latest/DSP-API/03-endpoints/api-v2/editing-values/#updating-a-file-value
+    file_value_type = FILE_VALUE_TYPES[resource["@type"]]
+    file_value = resource[f"knora-api:has{file_value_type}"]
+    payload = {
+        "@id": resource["@id"],
+        "@type": resource["@type"],
+        f"knora-api:has{file_value_type}": {
+            "@id": file_value["@id"],
+            "@type": f"knora-api:{file_value_type}",
+            "knora-api:fileValueHasFilename": internal_filename
+        },
+        "@context": {
+            "knora-api": "http://api.knora.org/ontology/knora-api/v2#",
+            "StadtGeschichteBasel_v1": API_HOST + "/ontology/" + PROJECT_SHORT_CODE + "/StadtGeschichteBasel_v1/v2#"
+        }
+    }
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "X-Asset-Ingested": "true",
+    }
+    identifier = extract_dasch_propvalue(resource, "identifier")
+    started = time.monotonic()
+    response = session.put(f"{API_HOST}/v2/values", json=payload, headers=headers, timeout=10)
+    if response.status_code == 200:
+        log_event("file", identifier, "ok", started, change="update", internal_filename=internal_filename)
+        logging.info(f"{identifier}: file replaced with {internal_filename}")
+        return True
+    log_event("file", identifier, "failed", started, change="update", http_status=response.status_code, error=response.text[:500])
+    logging.error(f"{identifier}: replacing the file failed: {response.status_code}")
+    return False
+
+
+def delete_resource(token: str, resource: dict, comment: str) -> bool:
+    # https://docs.dasch.swiss/latest/DSP-API/03-endpoints/api-v2/editing-resources/#deleting-a-resource
+    context_data = {
+        "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+        "knora-api": "http://api.knora.org/ontology/knora-api/v2#",
+        "StadtGeschichteBasel_v1": API_HOST + "/ontology/" + PROJECT_SHORT_CODE + "/StadtGeschichteBasel_v1/v2#",
+        "rdfs": "http://www.w3.org/2000/01/rdf-schema#"
+    }
+    payload = {
+        "@context": context_data,
+        "@id": resource["@id"],
+        "@type": resource["@type"],
+        "knora-api:deleteComment": comment
+    }
+    if "knora-api:lastModificationDate" in resource:
+        payload["knora-api:lastModificationDate"] = resource["knora-api:lastModificationDate"]
+    headers = {
+        "Authorization": f"Bearer {token}",
+    }
+    identifier = extract_dasch_propvalue(resource, "identifier")
+    started = time.monotonic()
+    response = session.post(f"{API_HOST}/v2/resources/delete", json=payload, headers=headers, timeout=10)
     if response.status_code == 200:
-        logging.info(f"{payload[f"{PREFIX}identifier"]["knora-api:valueAsString"]}: resource created on DaSCH")
+        log_event("resource", identifier, "ok", started, change="delete", resource_class=resource["@type"])
+        logging.info(f"{identifier}: resource deleted on DaSCH")
+        return True
+    log_event("resource", identifier, "failed", started, change="delete", resource_class=resource["@type"],
+              http_status=response.status_code, error=response.text[:500])
+    logging.error(f"{identifier}: resource deletion failed: {response.status_code}")
+    return False
+
+
+def sync_media_file(token: str, resource: dict, media: dict, media_class: str, checksums: dict, journal: SyncJournal) -> None:
+    """Re-ingests the file of an existing media resource if its Omeka checksum or size changed since the last ingest.
+
+    Media without a recorded checksum (ingested before checksums were recorded) get the current
+    Omeka checksum as baseline.
+    """
+    media_id = extract_dasch_propvalue(resource, "identifier")
+    file_value = resource.get(f"knora-api:has{FILE_VALUE_TYPES[media_class]}", {})
+    if media_id not in checksums:
+        record_checksum(CHECKSUM_FILE, checksums, media_id, media, file_value.get("knora-api:fileValueHasFilename"))
+        return
+    if not file_changed(checksums, media_id, media):
+        return
+    logging.info(f"{media_id}: file was replaced in Omeka, re-ingesting ...")
+    internal_filename = upload_file_from_url(media.get("o:original_url", ""), token, zip=(media_class == f"{PREFIX}sgb_MEDIA_ARCHIV"))
+    if internal_filename and update_file_value(token, resource, internal_filename):
+        record_checksum(CHECKSUM_FILE, checksums, media_id, media, internal_filename)
+        journal.record("file", media_id, "replaced", media.get("o:id"), internal_filename=internal_filename)
     else:
-        logging.error(f"{payload[f"{PREFIX}identifier"]["knora-api:valueAsString"]}: resource creation failed: {response.status_code}: {response.text}")
-        logging.error(payload)
+        journal.record("file", media_id, "failed", media.get("o:id"))
+
+
+def report_violations(journal: SyncJournal, kind: str, identifier: str, omeka_id, violations: list) -> None:
+    """Logs the violations of a resource that was rejected by the local validation and records it in the journal."""
+    for violation in violations:
+        logging.error(f"{identifier}: {violation}")
+    journal.record(kind, identifier, "invalid", omeka_id, violations=violations)
 
 
 def specify_mediaclass(media_type: str) -> str:
@@ -612,17 +866,169 @@ def specify_mediaclass(media_type: str) -> str:
         return f"{PREFIX}sgb_MEDIA_ARCHIV"
     
 
-def main() -> None:
+def bootstrap() -> dict:
+    """Fetches the state shared by all synchronised items once.
 
-    args = parse_arguments()
+    Returns:
+        dict: 'project_iri', 'project_lists', 'data_model' (compiled data model with the list node IRIs),
+              'checksums' (see load_checksums), 'iri_cache' (see find_resource_iri), 'skipped_media'
+              (Omeka IDs of media with a duplicate identifier, see duplicate_media) and 'recheck' (Omeka IDs
+              of items whose values, and those of their media, are compared even if the DSP resource is
+              newer, e.g. after a failed value write) and 'item_media' (media by Omeka item ID of the claimed
+              crawl, None if the media are fetched per item)
+    """
+    project_iri = get_project()
+    # get list and list values
+    project_lists = get_lists(project_iri)
+    data_model = load_data_model()
+    register_list_iris(data_model, project_lists)
+    return {
+        "project_iri": project_iri,
+        "project_lists": project_lists,
+        "data_model": data_model,
+        "checksums": load_checksums(CHECKSUM_FILE),
+        "iri_cache": {},
+        "skipped_media": set(),
+        "recheck": set(),
+        "item_media": None,
+    }
+
+
+def find_resource_iri(token: str, object_class: str, identifier: str, iri_cache: dict) -> str | None:
+    """Returns the IRI of the resource with the given identifier; found IRIs are kept in the cache."""
+    if (object_class, identifier) not in iri_cache:
+        iri = get_resource_by_id(token, object_class, identifier).get('@id')
+        if not iri:
+            return None
+        iri_cache[(object_class, identifier)] = iri
+    return iri_cache[(object_class, identifier)]
+
+
+def sync_object(token: str, item: dict, context: dict, journal: SyncJournal) -> str | None:
+    """Synchronises the metadata of one Omeka item with the DSP.
+
+    Args:
+        context (dict): the shared state returned by bootstrap
+
+    Returns:
+        str | None: the IRI of the sgb_OBJECT resource, None if it does not exist
+    """
+    item_id = extract_property(item.get("dcterms:identifier", []), 10)
+    metadata_iri = find_resource_iri(token, f"{PREFIX}sgb_OBJECT", item_id, context["iri_cache"])
+    if metadata_iri:
+        object = get_full_resource(token, urllib.parse.quote(metadata_iri, safe=''))
+
+        if 'knora-api:lastModificationDate' in object:
+            dasch_date = object['knora-api:lastModificationDate']['@value']
+        else:
+            dasch_date = object['knora-api:creationDate']['@value']
+        if item['o:modified']['@value'] > dasch_date or item.get("o:id") in context["recheck"]:
+            logging.info(f"{item_id}: object exists already, but it was modified. Update object ...")
+            modified_values = check_values(object, item, context["project_lists"])
+            # print(modified_values)
+            violations = validate_changes(context["data_model"], object, modified_values, PREFIX)
+            if violations:
+                report_violations(journal, "object", item_id, item.get("o:id"), violations)
+            else:
+                failed = [value for value in modified_values
+                          if not update_value(token, object,value["value"],value["field"],value["prop_type"],value["type"])]
+                # a failed write is not seen as modified anymore once other values moved the DSP date forward
+                journal.record("object", item_id, "failed" if failed else "updated", item.get("o:id"),
+                               changes=len(modified_values), failed_changes=len(failed))
+        else:
+            logging.info(f"{item_id}: object exists already")
+            journal.record("object", item_id, "unchanged", item.get("o:id"))
+
+    else:
+        payload = construct_payload(item, f"{PREFIX}sgb_OBJECT", context["project_iri"], context["project_lists"],"","")
+        violations = validate_payload(context["data_model"], payload, PREFIX)
+        if violations:
+            report_violations(journal, "object", item_id, item.get("o:id"), violations)
+        else:
+            created = create_resource(payload, token)
+            journal.record("object", item_id, "created" if created else "failed", item.get("o:id"))
+        metadata_iri = find_resource_iri(token, f"{PREFIX}sgb_OBJECT", item_id, context["iri_cache"])
+    return metadata_iri
+
+
+def sync_media(token: str, media: dict, metadata_iri: str | None, context: dict, journal: SyncJournal) -> None:
+    """Synchronises one Omeka media, linked to the sgb_OBJECT resource of its item, with the DSP.
+
+    Args:
+        context (dict): the shared state returned by bootstrap
+    """
+    media_id = extract_property(media.get("dcterms:identifier", []), 10)
+    if media.get("o:id") in context["skipped_media"]:
+        journal.record("media", media_id, "skipped", media.get("o:id"))
+        return
+    media_class = specify_mediaclass(extract_property(media.get("dcterms:format", []), 9))
+    mediadata_iri = find_resource_iri(token, media_class, media_id, context["iri_cache"])
+    if mediadata_iri:
+        object = get_full_resource(token, urllib.parse.quote(mediadata_iri, safe=''))
+
+        if 'knora-api:lastModificationDate' in object:
+            dasch_date = object['knora-api:lastModificationDate']['@value']
+        else:
+            dasch_date = object['knora-api:creationDate']['@value']
+        if media['o:modified']['@value'] > dasch_date or media.get("o:item", {}).get("o:id") in context["recheck"]:
+            logging.info(f"{media_id}: media exists already, but it was modified. Update object ...")
+            modified_values = check_values(object, media, context["project_lists"])
+            # print(modified_values)
+            violations = validate_changes(context["data_model"], object, modified_values, PREFIX)
+            if violations:
+                report_violations(journal, "media", media_id, media.get("o:id"), violations)
+            else:
+                failed = [value for value in modified_values
+                          if not update_value(token, object,value["value"],value["field"],value["prop_type"],value["type"])]
+                # a failed write is not seen as modified anymore once other values moved the DSP date forward
+                journal.record("media", media_id, "failed" if failed else "updated", media.get("o:id"),
+                               changes=len(modified_values), failed_changes=len(failed))
+        else:
+            logging.info(f"{media_id}: media exists already")
+            journal.record("media", media_id, "unchanged", media.get("o:id"))
+        sync_media_file(token, object, media, media_class, context["checksums"], journal)
+    else:
+        # validate before uploading; the file value itself is not part of the validation
+        violations = validate_payload(context["data_model"], construct_payload(media, media_class, context["project_iri"], context["project_lists"], metadata_iri, ""), PREFIX)
+        if violations:
+            report_violations(journal, "media", media_id, media.get("o:id"), violations)
+            return
+        logging.info(f"{media_id}: adding media to {media_class} ...")
+        object_location = media.get("o:original_url", "")
+        # zip file if it is not a dasch valid format;
+        internalFilename = upload_file_from_url(object_location,token, zip=(media_class == f"{PREFIX}sgb_MEDIA_ARCHIV"))
+        if internalFilename:
+            media_payload = construct_payload(media, media_class, context["project_iri"], context["project_lists"], metadata_iri,internalFilename)
+            created = create_resource(media_payload, token)
+            journal.record("media", media_id, "created" if created else "failed", media.get("o:id"))
+            if created:
+                record_checksum(CHECKSUM_FILE, context["checksums"], media_id, media, internalFilename)
+        else:
+            logging.error(f"{media_id}: could not create resource")
+            journal.record("media", media_id, "failed", media.get("o:id"))
 
-    # Fetch item data
-    items_data = get_items_from_collection(ITEM_SET_ID)
 
-    if args.mode == 'sample_data':
-        items_data = random.sample(items_data, NUMBER_RANDOM_OBJECTS)
+def sync_item(token: str, item: dict, context: dict, journal: SyncJournal) -> None:
+    """Synchronises one Omeka item and its media with the DSP.
 
-    if args.mode == 'test_data':
+    Args:
+        context (dict): the shared state returned by bootstrap
+    """
+    metadata_iri = sync_object(token, item, context, journal)
+    if context["item_media"] is None:
+        item_media = get_media(item.get("o:id", ""))
+    else:
+        # only the media of the crawl the identifiers were claimed for
+        item_media = context["item_media"].get(item.get("o:id"), [])
+    for media in item_media:
+        sync_media(token, media, metadata_iri, context, journal)
+
+
+def select_mode_items(items_data: list, mode: str) -> list:
+    if mode == 'sample_data':
+        return random.sample(items_data, min(NUMBER_RANDOM_OBJECTS, len(items_data)))
+
+    if mode == 'test_data':
         found_objects = []
         remaining_identifiers = TEST_DATA.copy()
 
@@ -631,71 +1037,210 @@ def main() -> None:
                 if identifier['@value'] in remaining_identifiers:
                     found_objects.append(obj)
                     remaining_identifiers.remove(identifier['@value'])
-                    
+
             if not remaining_identifiers:
                 break
-        items_data = found_objects
+        return found_objects
 
-    # get_project()
-    token = login(DSP_USER, DSP_PWD)
-    project_iri = get_project()
-    # get list and list values
-    project_lists = get_lists(project_iri)
+    return items_data
 
-    for item in items_data:
-        item_id = extract_property(item.get("dcterms:identifier", []), 10)
-        metadata_iri = get_resource_by_id(token, f"{PREFIX}sgb_OBJECT", item_id).get('@id')
-        if metadata_iri:
-            object = get_full_resource(token, urllib.parse.quote(metadata_iri, safe=''))
 
-            if 'knora-api:lastModificationDate' in object:
-                dasch_date = object['knora-api:lastModificationDate']['@value']
-            else:
-                dasch_date = object['knora-api:creationDate']['@value']
-            if item['o:modified']['@value'] > dasch_date:
-                logging.info(f"{item_id}: object exists already, but it was modified. Update object ...")
-                modified_values = check_values(object, item, project_lists)
-                # print(modified_values)
-                for value in modified_values:
-                    update_value(token, object,value["value"],value["field"],value["prop_type"],value["type"])
+def resolve_item_sets(item_sets: str | None, site_id: str | None, strict: bool = False) -> list:
+    if item_sets is None:
+        return [ITEM_SET_ID]
+    if item_sets == "all":
+        return get_item_sets(site_id, strict)
+    return [item_set.strip() for item_set in item_sets.split(",") if item_set.strip()]
+
+
+def fetch_collection(set_ids: list, strict: bool = False) -> tuple[list, list]:
+    """Fetches the items and media of all given item sets; items and media in several sets are returned once.
+
+    Returns:
+        tuple[list, list]: the items and the media
+    """
+    items = {}
+    media = {}
+    for set_id in set_ids:
+        set_items = get_items_from_collection(set_id, strict)
+        items.update((item.get("o:id"), item) for item in set_items)
+        set_media = get_media_from_collection(set_id, [item.get("o:id") for item in set_items], strict)
+        media.update((entry.get("o:id"), entry) for entry in set_media)
+    return list(items.values()), list(media.values())
+
+
+def fetch_set_items(set_ids: list, mode: str, strict: bool = False) -> dict:
+    """Fetches the items of every item set (see get_paginated_items for strict).
+
+    An item in several sets is synced once, with the first set it is found in; identifiers
+    are claimed across all sets (see claim_identifiers).
+
+    Returns:
+        dict: list of items by item set ID
+    """
+    set_items = {}
+    seen = set()
+    for set_id in set_ids:
+        items_data = select_mode_items(get_items_from_collection(set_id, strict), mode)
+        set_items[set_id] = [item for item in items_data if item.get("o:id") not in seen]
+        seen.update(item.get("o:id") for item in set_items[set_id])
+
+    claimed = {item.get("o:id") for item in claim_identifiers(list(chain.from_iterable(set_items.values())))}
+    return {set_id: [item for item in items_data if item.get("o:id") in claimed] for set_id, items_data in set_items.items()}
+
+
+def task_identifier(task: dict) -> str:
+    return extract_property((task["media"] or task["item"]).get("dcterms:identifier", []), 10)
+
+
+def run_task(tokens: TokenCache, task: dict, context: dict, journal: SyncJournal, deadline: Deadline, deferred: list) -> None:
+    """Runs one scheduled task, unless the time budget has run out; then the task is deferred to the next run."""
+    omeka_id = (task["media"] or task["item"]).get("o:id")
+    kind = "media" if task["kind"] == "media" else "object"
+    if deadline.passed():
+        deferred.append(task)
+        journal.record(kind, task_identifier(task), "deferred", omeka_id)
+        return
+    try:
+        with item_events(task["kind"], task_identifier(task), omeka_id):
+            token = tokens.get()
+            if task["kind"] == "item":
+                sync_item(token, task["item"], context, journal)
+            elif task["kind"] == "object":
+                sync_object(token, task["item"], context, journal)
             else:
-                logging.info(f"{item_id}: object exists already")
-                
+                item_id = extract_property(task["item"].get("dcterms:identifier", []), 10)
+                metadata_iri = find_resource_iri(token, f"{PREFIX}sgb_OBJECT", item_id, context["iri_cache"])
+                sync_media(token, task["media"], metadata_iri, context, journal)
+    except Exception:
+        logging.exception(f"Sync of {kind} {omeka_id} failed")
+        journal.record(kind, task_identifier(task), "failed", omeka_id)
+
+
+def build_tasks(set_items: dict, split_media: bool, set_media: dict | None = None) -> list:
+    """Lists the tasks of all item sets, taking the sets in turn so a large set does not hold back the others.
+
+    Without split_media each task syncs an item with its media; otherwise there is one task per
+    object and one per media, and the media are fetched in bulk per item set unless they are
+    given in set_media (media by item set ID).
+    """
+    set_tasks = []
+    for set_id, items_data in set_items.items():
+        if not split_media:
+            set_tasks.append([{"kind": "item", "item": item, "media": None, "item_set": set_id} for item in items_data])
+            continue
+        tasks = [{"kind": "object", "item": item, "media": None, "item_set": set_id} for item in items_data]
+        items_by_id = {item.get("o:id"): item for item in items_data}
+        if set_media is None:
+            media_data = get_media_from_collection(set_id, list(items_by_id))
         else:
-            payload = construct_payload(item, f"{PREFIX}sgb_OBJECT", project_iri, project_lists,"","")
-            create_resource(payload, token)
-            metadata_iri = get_resource_by_id(token, f"{PREFIX}sgb_OBJECT", item_id).get('@id')
-        media_data = get_media(item.get("o:id", ""))
-        if media_data:
-            for media in media_data:
-                media_id = extract_property(media.get("dcterms:identifier", []), 10)
-                media_class = specify_mediaclass(extract_property(media.get("dcterms:format", []), 9))
-                mediadata_iri = get_resource_by_id(token, media_class, media_id).get('@id')
-                if mediadata_iri:
-                    object = get_full_resource(token, urllib.parse.quote(mediadata_iri, safe=''))
-
-                    if 'knora-api:lastModificationDate' in object:
-                        dasch_date = object['knora-api:lastModificationDate']['@value']
-                    else:
-                        dasch_date = object['knora-api:creationDate']['@value']
-                    if media['o:modified']['@value'] > dasch_date:
-                        logging.info(f"{media_id}: media exists already, but it was modified. Update object ...")
-                        modified_values = check_values(object, media, project_lists)
-                        # print(modified_values)
-                        for value in modified_values:
-                            update_value(token, object,value["value"],value["field"],value["prop_type"],value["type"])
-                    else:
-                        logging.info(f"{media_id}: media exists already")
-                else:
-                    logging.info(f"{media_id}: adding media to {media_class} ...")
-                    object_location = media.get("o:original_url", "")
-                    # zip file if it is not a dasch valid format;
-                    internalFilename = upload_file_from_url(object_location,token, zip=(media_class == f"{PREFIX}sgb_MEDIA_ARCHIV"))
-                    if internalFilename:
-                        media_payload = construct_payload(media, media_class, project_iri, project_lists, metadata_iri,internalFilename)
-                        create_resource(media_payload, token)
-                    else:
-                        logging.error(f"{media_id}: could not create resource")
+            media_data = [media for media in set_media[set_id] if media.get("o:item", {}).get("o:id") in items_by_id]
+        for media in media_data:
+            item = items_by_id[media.get("o:item", {}).get("o:id")]
+            tasks.append({"kind": "media", "item": item, "media": media, "item_set": set_id})
+        set_tasks.append(tasks)
+    return [task for round_tasks in zip_longest(*set_tasks) for task in round_tasks if task]
+
+
+def budget_exhausted(deadline: Deadline, step: str) -> bool:
+    """Checks the time budget between the fetch steps; the tasks left over by the last run stay pending."""
+    if deadline.passed():
+        logging.warning(f"Time budget exhausted while {step}, nothing synced")
+        return True
+    return False
+
+
+def main() -> None:
+
+    args = parse_arguments()
+    # the time budget includes fetching the collection and the bootstrap
+    deadline = Deadline(args.time_budget)
+    # shards running in the same directory must not rotate the log files of each other
+    setup_logging(f"data_2_dasch{shard_suffix(*args.shard) if args.shard else ''}")
+
+    # Fetch item data; items and media of different shards or workers are synced at the same time,
+    # so their identifiers are claimed up front, which needs the same complete crawl in every process:
+    # a request error aborts the run
+    claimed = bool(args.shard) or args.workers > 1
+    set_ids = resolve_item_sets(args.item_sets, args.site_id, strict=claimed)
+    set_items = fetch_set_items(set_ids, args.mode, strict=claimed)
+    if budget_exhausted(deadline, "fetching the items"):
+        return
+    set_media = None
+    skipped_media = set()
+    if claimed:
+        set_media = {
+            set_id: get_media_from_collection(set_id, [item.get("o:id") for item in items_data], strict=True)
+            for set_id, items_data in set_items.items()
+        }
+        skipped_media = duplicate_media(list(chain.from_iterable(set_media.values())))
+        if budget_exhausted(deadline, "fetching the media"):
+            return
+
+    report_name = "data_2_dasch"
+    shard_info = {}
+    if args.shard:
+        shard, total = args.shard
+        set_items = {
+            set_id: [item for item in items_data if shard_of(item.get("o:id"), total) == shard]
+            for set_id, items_data in set_items.items()
+        }
+        shard_info["shard"] = f"{shard}/{total}"
+        logging.info(f"Shard {shard}/{total}: processing {sum(len(items_data) for items_data in set_items.values())} items")
+
+    # items left over by the last run come first, whatever the priorities
+    pending_path = f"{report_name}{shard_suffix(*args.shard) if args.shard else ''}.pending.json"
+    run_ids = {item.get("o:id") for items_data in set_items.values() for item in items_data}
+    previous = load_pending(pending_path)
+    pending = [entry for entry in previous if entry["omeka_id"] not in run_ids]
+    pending_ids = {entry["omeka_id"] for entry in previous}
+    phases = plan_tasks(build_tasks(set_items, splits_media(args.priority), set_media), args.priority, pending_ids)
+    if budget_exhausted(deadline, "fetching the media"):
+        return
+
+    # authentication, lists, data model and IRI cache are shared by all item sets
+    tokens = TokenCache(DSP_USER, DSP_PWD)
+    context = bootstrap()
+    context["skipped_media"] = skipped_media
+    if set_media is not None:
+        context["item_media"] = {}
+        for entry in chain.from_iterable(set_media.values()):
+            context["item_media"].setdefault(entry.get("o:item", {}).get("o:id"), []).append(entry)
+    if budget_exhausted(deadline, "bootstrapping"):
+        return
+
+    journals = {}
+    for set_id, items_data in set_items.items():
+        # one report per item set when several sets are synced
+        set_report = f"{report_name}.set-{set_id}" if args.item_sets else report_name
+        if args.shard:
+            set_report += shard_suffix(*args.shard)
+        journals[set_id] = SyncJournal(f"{set_report}.journal.jsonl", f"{set_report}.metrics.json",
+                                       item_set=set_id, items=len(items_data), **shard_info)
+
+    deferred = []
+    for tasks in phases:
+        # a phase ends before the next starts, so every media finds the object of its item
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for task in tasks:
+                executor.submit(run_task, tokens, task, context, journals[task["item_set"]], deadline, deferred)
+
+    pending += [
+        {"item_set": task["item_set"], "omeka_id": task["item"].get("o:id"), "kind": task["kind"],
+         "identifier": task_identifier(task), "media_id": task["media"].get("o:id") if task["media"] else None}
+        for task in deferred
+    ]
+    save_pending(pending_path, pending)
+    if deferred:
+        logging.warning(f"Time budget exhausted: {len(deferred)} tasks deferred to the next run, see {pending_path}")
+
+    for set_id, journal in journals.items():
+        counts = ", ".join(f"{kind} {action}: {number}" for (kind, action), number in sorted(journal.counts.items()))
+        logging.info(f"Item set {set_id}: {counts or 'nothing synced'}")
+        invalid = sum(number for (kind, action), number in journal.counts.items() if action == "invalid")
+        if invalid:
+            logging.warning(f"{invalid} resources were not synced because of validation errors, see {journal.journal_path}")
+        journal.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+import json
+from pathlib import Path
+
+DATA_MODEL_PATH = Path(__file__).resolve().parent.parent / "data" / "data_model_dasch.json"
+
+
+def parse_cardinality(cardinality: str) -> tuple[int, int | None]:
+    """Converts a DSP cardinality ('1', '0-1', '0-n', '1-n') into (minimum, maximum); None means unbounded."""
+    if "-" not in cardinality:
+        return int(cardinality), int(cardinality)
+    minimum, maximum = cardinality.split("-")
+    return int(minimum), None if maximum == "n" else int(maximum)
+
+
+def load_data_model(path: Path = DATA_MODEL_PATH) -> dict:
+    """Compiles the DSP-TOOLS project definition into lookup tables.
+
+    Returns:
+        dict: with the keys
+            'shortcode', 'ontology',
+            'classes' (class name -> property name -> (minimum, maximum), including inherited cardinalities),
+            'properties' (property name -> {'object': value type, 'list': list name or None}),
+            'lists' (list name -> {'labels': set of list labels, 'nodes': node name -> set of node labels,
+                     'iris': set of node IRIs on the DSP, see register_list_iris})
+    """
+    with open(path, encoding="utf-8") as model_file:
+        project = json.load(model_file)["project"]
+    ontology = project["ontologies"][0]
+
+    properties = {}
+    for prop in ontology["properties"]:
+        properties[prop["name"]] = {
+            "object": prop["object"].lstrip(":"),
+            "list": prop.get("gui_attributes", {}).get("hlist"),
+        }
+
+    definitions = {resource["name"]: resource for resource in ontology["resources"]}
+
+    def cardinalities(name: str) -> dict:
+        resource = definitions[name]
+        supers = resource.get("super", [])
+        supers = [supers] if isinstance(supers, str) else supers
+        result = {}
+        for parent in supers:
+            if parent.startswith(":"):
+                result.update(cardinalities(parent[1:]))
+        for entry in resource.get("cardinalities", []):
+            result[entry["propname"].lstrip(":")] = parse_cardinality(entry["cardinality"])
+        return result
+
+    lists = {}
+    for project_list in project["lists"]:
+        lists[project_list["name"]] = {
+            "labels": set(project_list["labels"].values()),
+            "nodes": {node["name"]: set(node["labels"].values()) for node in project_list["nodes"]},
+            "iris": set(),
+        }
+
+    return {
+        "shortcode": project["shortcode"],
+        "ontology": ontology["name"],
+        "classes": {name: cardinalities(name) for name in definitions},
+        "properties": properties,
+        "lists": lists,
+    }
+
+
+def lists_from_data_model(model: dict) -> list:
+    """Returns the lists of the data model in the structure of the DSP lists API (as returned by get_lists).
+
+    The node names of the data model take the place of the list node IRIs, so payloads built
+    with these lists reference the nodes the way DSP-TOOLS expects them.
+    """
+    lists = []
+    for list_name, project_list in model["lists"].items():
+        nodes = [
+            {"@id": node_name, "rdfs:label": label}
+            for node_name, labels in project_list["nodes"].items()
+            for label in labels
+        ]
+        for label in project_list["labels"]:
+            lists.append({"@id": list_name, "rdfs:label": label, "knora-api:hasSubListNode": nodes})
+    return lists
+
+
+def register_list_iris(model: dict, project_lists: list) -> None:
+    """Adds the node IRIs of the lists fetched from the DSP (see get_lists) to the matching lists of the model."""
+    for project_list in project_lists:
+        for list_name, model_list in model["lists"].items():
+            if project_list["rdfs:label"] in model_list["labels"]:
+                nodes = project_list.get("knora-api:hasSubListNode", [])
+                # a list with a single node has the node itself instead of an array
+                model_list["iris"].update(node["@id"] for node in ([nodes] if isinstance(nodes, dict) else nodes))
+
+
+def validate_resource(model: dict, resource_class: str, values: dict) -> list:
+    """Checks the values of one resource against the classes, cardinalities and lists of the data model.
+
+    Args:
+        resource_class (str): class name without prefix, e.g. 'sgb_OBJECT'
+        values (dict): property name without prefix -> list of (value type, value)
+
+    Returns:
+        list: a description of every violation, empty if the resource is valid
+    """
+    if resource_class not in model["classes"]:
+        return [f"unknown resource class '{resource_class}'"]
+    violations = []
+    cardinalities = model["classes"][resource_class]
+    for prop, entries in values.items():
+        if prop not in cardinalities:
+            violations.append(f"property '{prop}' is not allowed for {resource_class}")
+            continue
+        for value_type, value in entries:
+            violations.extend(validate_value(model, prop, value_type, value))
+    for prop, (minimum, maximum) in cardinalities.items():
+        number = len(values.get(prop, []))
+        if number < minimum or (maximum is not None and number > maximum):
+            violations.append(f"{prop}: {number} values violate cardinality {minimum}-{'n' if maximum is None else maximum}")
+    return violations
+
+
+def payload_values(payload: dict, prefix: str) -> tuple[dict, list]:
+    """Collects the values of a payload or resource as property name -> list of (value type, value).
+
+    Empty text values are left out like optional values that are not set. Unresolved list nodes
+    (an Omeka label without node IRI, see list_value_entry), unresolved links and empty URIs are
+    returned as violations.
+
+    Returns:
+        tuple[dict, list]: the values and the violations
+    """
+    values = {}
+    violations = []
+    for key, entries in payload.items():
+        if not key.startswith(prefix):
+            continue
+        prop = key.removeprefix(prefix)
+        if isinstance(entries, dict):
+            entries = [entries]
+        for entry in entries:
+            value_type = entry.get("@type", "").removeprefix("knora-api:")
+            if value_type == "LinkValue":
+                prop = prop.removesuffix("Value")
+            value = extract_entry_value(entry)
+            if value:
+                values.setdefault(prop, []).append((value_type, value))
+            elif value_type == "ListValue" and entry.get("knora-api:listValueAsListNode", {}).get("rdfs:label"):
+                label = entry["knora-api:listValueAsListNode"]["rdfs:label"]
+                violations.append(f"{prop}: '{label}' is not a node of the list")
+            elif value_type != "TextValue":
+                violations.append(f"{prop}: empty or unresolved {value_type}")
+    return values, violations
+
+
+def extract_entry_value(entry: dict):
+    value_type = entry.get("@type")
+    if value_type == "knora-api:TextValue":
+        return entry.get("knora-api:valueAsString")
+    if value_type == "knora-api:ListValue":
+        return entry.get("knora-api:listValueAsListNode", {}).get("@id")
+    if value_type == "knora-api:LinkValue":
+        return entry.get("knora-api:linkValueHasTargetIri", {}).get("@id")
+    if value_type == "knora-api:UriValue":
+        value = entry.get("knora-api:uriValueAsUri", {}).get("@value")
+        return value.strip() if value else value
+    return None
+
+
+def validate_payload(model: dict, payload: dict, prefix: str) -> list:
+    """Checks a create_resource payload against the data model.
+
+    Returns:
+        list: a description of every violation, empty if the payload is valid
+    """
+    values, violations = payload_values(payload, prefix)
+    return violations + validate_resource(model, payload["@type"].removeprefix(prefix), values)
+
+
+def validate_changes(model: dict, resource: dict, changes: list, prefix: str) -> list:
+    """Checks the value changes of an existing resource (as returned by check_values) against the data model.
+
+    The cardinalities are checked for the state of the resource after all changes are applied.
+    Creates of an empty Omeka value are no changes and left out; a value of None is an Omeka
+    label that could not be resolved (e.g. a list node) and is reported.
+
+    Returns:
+        list: a description of every violation, empty if all changes are valid
+    """
+    resource_class = resource["@type"].removeprefix(prefix)
+    if resource_class not in model["classes"]:
+        return [f"unknown resource class '{resource_class}'"]
+    cardinalities = model["classes"][resource_class]
+    violations = []
+    counts = {}
+    for change in changes:
+        field = change["field"]
+        if change["type"] == "create" and change["value"] == "":
+            continue
+        if field not in cardinalities:
+            violations.append(f"property '{field}' is not allowed for {resource_class}")
+            continue
+        if field not in counts:
+            entries = resource.get(f"{prefix}{field}", [])
+            counts[field] = len(entries) if isinstance(entries, list) else 1
+        if change["type"] == "create":
+            counts[field] += 1
+        elif change["type"] == "delete":
+            counts[field] -= 1
+            continue
+        if change["value"] is None:
+            violations.append(f"{field}: unresolved {change['prop_type']}")
+            continue
+        value = change["value"].strip() if isinstance(change["value"], str) else change["value"]
+        if not value:
+            violations.append(f"{field}: empty {change['prop_type']}")
+            continue
+        violations.extend(validate_value(model, field, change["prop_type"], value))
+
+    for field, number in counts.items():
+        minimum, maximum = cardinalities[field]
+        if number < minimum or (maximum is not None and number > maximum):
+            violations.append(f"{field}: {number} values violate cardinality {minimum}-{'n' if maximum is None else maximum}")
+    return violations
+
+
+def validate_value(model: dict, prop: str, value_type: str, value: str) -> list:
+    expected_type = model["properties"][prop]["object"]
+    list_name = model["properties"][prop]["list"]
+    violations = []
+    if expected_type != value_type and not (expected_type.startswith("sgb_") and value_type == "LinkValue"):
+        violations.append(f"{prop}: expected {expected_type}, got {value_type}")
+    if list_name and value not in model["lists"][list_name]["nodes"] and value not in model["lists"][list_name]["iris"]:
+        violations.append(f"{prop}: '{value}' is not a node of list {list_name}")
+    return violations
@@ -0,0 +1,106 @@
+import atexit
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import random
+import threading
+import time
+
+EVENT_SAMPLE_RATE = float(os.getenv("EVENT_SAMPLE_RATE", "1.0"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+events = logging.getLogger("data_2_dasch.events")
+events.propagate = False
+_item = threading.local()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")
+        return json.dumps({"ts": timestamp, **record.event}, ensure_ascii=False)
+
+
+class SuccessSampler(logging.Filter):
+    """Keeps only a share of the successful operations; failures and item summaries are always kept."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = record.event
+        return event.get("status") != "ok" or event.get("event") == "item" or random.random() < self.rate
+
+
+def rotating_handler(path: str) -> RotatingFileHandler:
+    """Opens a rotating log file; the log of the previous run is rotated away instead of truncated."""
+    handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if os.path.getsize(path) > 0:
+        handler.doRollover()
+    return handler
+
+
+def setup_logging(name: str, sample_rate: float = EVENT_SAMPLE_RATE) -> None:
+    """Sends the text log and the event log through queues, written by background threads.
+
+    Called by the entry point of each script, so every script rotates only its own files: the
+    text log goes to the console and to '<name>.log', the events as JSON lines to
+    '<name>.events.jsonl'. Pending records are written when the process exits.
+    """
+    file_handler = rotating_handler(f"{name}.log")
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_queue = queue.SimpleQueue()
+    log_queue_handler = QueueHandler(log_queue)
+    log_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+
+    event_handler = rotating_handler(f"{name}.events.jsonl")
+    event_handler.setFormatter(JsonFormatter())
+    event_queue = queue.SimpleQueue()
+    event_queue_handler = QueueHandler(event_queue)
+    event_queue_handler.addFilter(SuccessSampler(sample_rate))
+    events.addHandler(event_queue_handler)
+    events.setLevel(logging.INFO)
+
+    for listener in (QueueListener(log_queue, stream_handler, file_handler), QueueListener(event_queue, event_handler)):
+        listener.start()
+        atexit.register(listener.stop)
+
+
+def log_event(event: str, identifier: str, status: str, started: float | None = None, **fields) -> None:
+    """Records one operation (e.g. event 'value' with field and change) in the event log.
+
+    Args:
+        status (str): 'ok' or 'failed'
+        started (float): time.monotonic() at the start of the operation, for the latency
+    """
+    record = {"event": event, "identifier": identifier, "status": status, **fields}
+    if started is not None:
+        record["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    summary = getattr(_item, "summary", None)
+    if summary is not None:
+        summary[status] = summary.get(status, 0) + 1
+    events.info(event, extra={"event": record})
+
+
+@contextmanager
+def item_events(kind: str, identifier: str, omeka_id=None):
+    """Counts the operations of one item and records them as a summary event when the item is done."""
+    _item.summary = {}
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        operations, _item.summary = _item.summary, None
+        events.info("item", extra={"event": {
+            "event": "item", "kind": kind, "identifier": identifier, "omeka_id": omeka_id,
+            "status": "failed" if operations.get("failed") else "ok", "operations": operations,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        }})
@@ -0,0 +1,19 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept open per host; should be at least the number of concurrent workers
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """Creates a session whose connection pools are shared by all requests to Omeka and the DSP."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = create_session()
@@ -0,0 +1,36 @@
+import json
+import os
+
+
+def load_checksums(path: str) -> dict:
+    """Loads the checksums of the ingested media files.
+
+    The file is append-only (one JSON line per ingest), so several processes can record into
+    the same file; the last entry of an identifier wins.
+
+    Returns:
+        dict: {'sha256': ..., 'size': ..., 'internal_filename': ...} by media identifier
+    """
+    checksums = {}
+    if not os.path.exists(path):
+        return checksums
+    with open(path, encoding="utf-8") as checksum_file:
+        for line in checksum_file:
+            if line.strip():
+                entry = json.loads(line)
+                checksums[entry.pop("identifier")] = entry
+    return checksums
+
+
+def record_checksum(path: str, checksums: dict, identifier: str, media: dict, internal_filename: str) -> None:
+    """Records the Omeka checksum and size of a media file that was ingested with the given internal filename."""
+    entry = {"sha256": media.get("o:sha256"), "size": media.get("o:size"), "internal_filename": internal_filename}
+    checksums[identifier] = entry
+    with open(path, "a", encoding="utf-8") as checksum_file:
+        checksum_file.write(json.dumps({"identifier": identifier, **entry}) + "\n")
+
+
+def file_changed(checksums: dict, identifier: str, media: dict) -> bool:
+    """Returns True if the file of a media differs from the recorded ingested file."""
+    recorded = checksums[identifier]
+    return recorded["sha256"] != media.get("o:sha256") or recorded["size"] != media.get("o:size")
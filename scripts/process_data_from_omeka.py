@@ -1,9 +1,12 @@
+import hashlib
 import logging
 import os
 from urllib.parse import urljoin, urlparse
 
 import requests
 
+from http_session import session
+
 # Configuration
 OMEKA_API_URL = os.getenv("OMEKA_API_URL", 'https://omeka.unibe.ch/api/')
 KEY_IDENTITY = os.getenv("KEY_IDENTITY")
@@ -22,28 +25,39 @@ def is_valid_url(url):
 
 
 def download_file(url, dest_path):
-    """Downloads a file from a given URL to the specified destination path."""
+    """Downloads a file from a given URL to the specified destination path.
+
+    Returns the SHA-256 hex digest of the downloaded file.
+    """
     os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    digest = hashlib.sha256()
     try:
-        with requests.get(url, stream=True) as r:
+        with session.get(url, stream=True) as r:
             r.raise_for_status()
             with open(dest_path, "wb") as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
+                    digest.update(chunk)
     except requests.exceptions.RequestException as err:
         logging.error(f"File download error: {err}")
         raise
+    return digest.hexdigest()
+
 
+def get_paginated_items(url, params, strict=False):
+    """Fetches all items from a paginated API endpoint.
 
-def get_paginated_items(url, params):
-    """Fetches all items from a paginated API endpoint."""
+    On a request error the items fetched so far are returned, or with strict=True the error is raised.
+    """
     items = []
     while url:
         try:
-            response = requests.get(url, params=params)
+            response = session.get(url, params=params)
             response.raise_for_status()
         except requests.exceptions.RequestException as err:
             logging.error(f"Error fetching items: {err}")
+            if strict:
+                raise
             break
         items.extend(response.json())
         url = response.links.get("next", {}).get("url")
@@ -52,15 +66,28 @@ def get_paginated_items(url, params):
     return items
 
 
-def get_items_from_collection(collection_id):
-    """Fetches all items from a specified collection."""
+def get_items_from_collection(collection_id, strict=False):
+    """Fetches all items from a specified collection (see get_paginated_items for strict)."""
     params = {
         "item_set_id": collection_id,
         "key_identity": KEY_IDENTITY,
         "key_credential": KEY_CREDENTIAL,
         "per_page": 100,
     }
-    return get_paginated_items(urljoin(OMEKA_API_URL, "items"), params)
+    return get_paginated_items(urljoin(OMEKA_API_URL, "items"), params, strict)
+
+
+def get_item_sets(site_id=None, strict=False):
+    """Fetches the IDs of all item sets, or of the item sets assigned to a site (see get_paginated_items for strict)."""
+    params = {
+        "key_identity": KEY_IDENTITY,
+        "key_credential": KEY_CREDENTIAL,
+        "per_page": 100,
+    }
+    if site_id:
+        params["site_id"] = site_id
+    item_sets = get_paginated_items(urljoin(OMEKA_API_URL, "item_sets"), params, strict)
+    return [str(item_set.get("o:id")) for item_set in item_sets]
 
 
 def get_media(item_id):
@@ -71,6 +98,79 @@ def get_media(item_id):
     )
 
 
+def get_media_from_collection(collection_id, item_ids, strict=False):
+    """Fetches the media of all items of a collection with paginated bulk requests.
+
+    Only media attached to one of the given item IDs are returned (see get_paginated_items for strict).
+    """
+    params = {
+        "item_set_id": collection_id,
+        "key_identity": KEY_IDENTITY,
+        "key_credential": KEY_CREDENTIAL,
+        "per_page": 100,
+    }
+    media = get_paginated_items(urljoin(OMEKA_API_URL, "media"), params, strict)
+    item_ids = set(item_ids)
+    return [entry for entry in media if entry.get("o:item", {}).get("o:id") in item_ids]
+
+
+def get_modified_since(resource_type, collection_id, since):
+    """Fetches the items or media of a collection that were modified after the given timestamp.
+
+    The results are requested newest first, so paging stops at the first older entry.
+    A request error is raised, as a partial result would let the caller skip modified entries.
+    """
+    url = urljoin(OMEKA_API_URL, resource_type)
+    params = {
+        "item_set_id": collection_id,
+        "key_identity": KEY_IDENTITY,
+        "key_credential": KEY_CREDENTIAL,
+        "sort_by": "modified",
+        "sort_order": "desc",
+        "per_page": 100,
+    }
+    modified = []
+    while url:
+        try:
+            response = session.get(url, params=params)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            logging.error(f"Error fetching {resource_type}: {err}")
+            raise
+        for entry in response.json():
+            if entry.get("o:modified", {}).get("@value", "") <= since:
+                return modified
+            modified.append(entry)
+        url = response.links.get("next", {}).get("url")
+        params = None
+    return modified
+
+
+def get_item(item_id):
+    """Fetches a single item by its Omeka ID, returns None if it does not exist."""
+    params = {"key_identity": KEY_IDENTITY, "key_credential": KEY_CREDENTIAL}
+    try:
+        response = session.get(urljoin(OMEKA_API_URL, f"items/{item_id}"), params=params)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as err:
+        logging.error(f"Error fetching item {item_id}: {err}")
+        return None
+    return response.json()
+
+
+def get_item_by_identifier(identifier):
+    """Fetches a single item by its dcterms:identifier, returns None if it does not exist."""
+    params = {
+        "key_identity": KEY_IDENTITY,
+        "key_credential": KEY_CREDENTIAL,
+        "property[0][property]": 10,
+        "property[0][type]": "eq",
+        "property[0][text]": identifier,
+    }
+    items = get_paginated_items(urljoin(OMEKA_API_URL, "items"), params)
+    return items[0] if items else None
+
+
 # --- Data Extraction and Transformation Functions ---
 def extract_property(props, prop_id, as_uri=False, only_label=False):
     """Extracts a property value or URI from properties based on property ID."""
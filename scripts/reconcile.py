@@ -0,0 +1,179 @@
+import argparse
+from argparse import Namespace
+import json
+import logging
+import time
+
+from data_2_dasch import (
+    PREFIX,
+    DSP_USER,
+    DSP_PWD,
+    fetch_collection,
+    resolve_item_sets,
+    login,
+    get_resources_of_class,
+    get_media_parents,
+    get_full_resources,
+    delete_resource,
+    update_value,
+    extract_dasch_propvalue,
+)
+from event_log import setup_logging
+from process_data_from_omeka import extract_property
+from sync_journal import SyncJournal
+
+MEDIA_CLASSES = ["sgb_MEDIA_IMAGE", "sgb_MEDIA_DOCUMENT", "sgb_MEDIA_TEXT", "sgb_MEDIA_ARCHIV"]
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Finds DSP resources that were removed or re-parented in Omeka")
+    parser.add_argument("--delete", action="store_true", help="delete the orphaned resources on the DSP (marks them as deleted)")
+    parser.add_argument("--reparent", action="store_true", help="link re-parented media to their new parent object")
+    parser.add_argument("--batch-size", type=int, default=25, help="number of resources fetched and changed per batch")
+    parser.add_argument("--rate", type=float, default=2.0, help="maximum number of write requests per second")
+    parser.add_argument("--max-orphans", type=float, default=10.0,
+                        help="refuse to delete if more than this percentage of the DSP objects or media are orphaned")
+    parser.add_argument("--force", action="store_true", help="delete even if the orphans exceed --max-orphans")
+    parser.add_argument("-o", "--output", default="data_2_dasch.reconcile", help="prefix of the report, journal and metrics file")
+    parser.add_argument("--item-sets", type=str, default=None,
+                        help="comma-separated item set IDs or 'all' (all item sets of the site) that make up the collection (default: ITEM_SET_ID)")
+    parser.add_argument("--site-id", type=str, default=None, help="restricts '--item-sets all' to the item sets of this Omeka site")
+    return parser.parse_args()
+
+
+def reconcile(omeka_objects: dict, omeka_media: dict, dasch_objects: dict, dasch_media: dict, dasch_parents: dict) -> dict:
+    """Compares the identifiers of both sides with set operations.
+
+    Args:
+        omeka_objects (dict): Omeka item identifiers (identifier -> Omeka o:id)
+        omeka_media (dict): parent item identifier by Omeka media identifier
+        dasch_objects (dict): resource IRI by identifier of all sgb_OBJECT resources
+        dasch_media (dict): resource IRI by identifier of all sgb_MEDIA_* resources
+        dasch_parents (dict): IRI of the linked sgb_OBJECT by media identifier
+
+    Returns:
+        dict: 'orphaned_objects' and 'orphaned_media' (identifiers only on the DSP) and
+              'reparented_media' (media identifier -> new parent identifier)
+    """
+    orphaned_objects = dasch_objects.keys() - omeka_objects.keys()
+    orphaned_media = dasch_media.keys() - omeka_media.keys()
+
+    object_identifiers = {iri: identifier for identifier, iri in dasch_objects.items()}
+    reparented_media = {
+        identifier: omeka_media[identifier]
+        for identifier in dasch_media.keys() & omeka_media.keys()
+        if object_identifiers.get(dasch_parents.get(identifier)) != omeka_media[identifier]
+        and omeka_media[identifier] in dasch_objects
+    }
+    return {
+        "orphaned_objects": sorted(orphaned_objects),
+        "orphaned_media": sorted(orphaned_media),
+        "reparented_media": dict(sorted(reparented_media.items())),
+    }
+
+
+class RateLimiter:
+    """Spaces write requests so that at most `rate` requests per second are sent."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self._last = 0.0
+
+    def wait(self) -> None:
+        delay = self._last + self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._last = time.monotonic()
+
+
+def excessive_orphans(result: dict, dasch_objects: dict, dasch_media: dict, max_percent: float) -> list:
+    """Returns a description of every resource kind whose share of orphans exceeds max_percent."""
+    excessive = []
+    for kind, orphans, resources in (("objects", result["orphaned_objects"], dasch_objects),
+                                     ("media", result["orphaned_media"], dasch_media)):
+        if resources and len(orphans) * 100 / len(resources) > max_percent:
+            excessive.append(f"{len(orphans)} of {len(resources)} {kind}")
+    return excessive
+
+
+def batches(entries: list, batch_size: int):
+    for start in range(0, len(entries), batch_size):
+        yield entries[start:start + batch_size]
+
+
+def delete_orphans(token: str, iris: list, kind: str, batch_size: int, limiter: RateLimiter, journal: SyncJournal) -> None:
+    for number, batch in enumerate(batches(iris, batch_size), start=1):
+        logging.info(f"Deleting orphaned {kind} batch {number} ({len(batch)} resources) ...")
+        for resource in get_full_resources(token, batch, batch_size):
+            limiter.wait()
+            deleted = delete_resource(token, resource, "Removed from the Omeka collection")
+            journal.record(kind, extract_dasch_propvalue(resource, "identifier"), "deleted" if deleted else "failed")
+
+
+def reparent_media(token: str, reparented: dict, dasch_media: dict, dasch_objects: dict, batch_size: int,
+                   limiter: RateLimiter, journal: SyncJournal) -> None:
+    iris = [dasch_media[identifier] for identifier in reparented]
+    for number, batch in enumerate(batches(iris, batch_size), start=1):
+        logging.info(f"Re-parenting media batch {number} ({len(batch)} resources) ...")
+        for resource in get_full_resources(token, batch, batch_size):
+            identifier = extract_dasch_propvalue(resource, "identifier")
+            parent_iri = dasch_objects[reparented[identifier]]
+            field = "partOf_MetadataValue"
+            if not isinstance(resource.get(f"{PREFIX}{field}"), dict):
+                # no link or several links: not changed automatically
+                logging.warning(f"{identifier}: media is not linked to exactly one object, re-parent manually")
+                journal.record("media", identifier, "failed")
+                continue
+            limiter.wait()
+            updated = update_value(token, resource, parent_iri, field, "LinkValue", "update")
+            journal.record("media", identifier, "reparented" if updated else "failed", parent=reparented[identifier])
+
+
+def main() -> None:
+    args = parse_arguments()
+    setup_logging("data_2_dasch.reconcile")
+
+    # a partial crawl would turn the missing resources into orphans, so any request error aborts
+    items, media = fetch_collection(resolve_item_sets(args.item_sets, args.site_id, strict=True), strict=True)
+    omeka_objects = {extract_property(item.get("dcterms:identifier", []), 10): item.get("o:id") for item in items}
+    item_identifiers = {item_id: identifier for identifier, item_id in omeka_objects.items()}
+    omeka_media = {
+        extract_property(entry.get("dcterms:identifier", []), 10): item_identifiers.get(entry.get("o:item", {}).get("o:id"))
+        for entry in media
+    }
+
+    token = login(DSP_USER, DSP_PWD)
+    # the same holds for the DSP side: a failed Gravsearch page raises
+    dasch_objects = get_resources_of_class(token, f"{PREFIX}sgb_OBJECT")
+    dasch_media = {}
+    dasch_parents = {}
+    for media_class in MEDIA_CLASSES:
+        dasch_media.update(get_resources_of_class(token, f"{PREFIX}{media_class}"))
+        dasch_parents.update(get_media_parents(token, f"{PREFIX}{media_class}"))
+
+    result = reconcile(omeka_objects, omeka_media, dasch_objects, dasch_media, dasch_parents)
+    with open(f"{args.output}.json", "w", encoding="utf-8") as report_file:
+        json.dump(result, report_file, indent=4, ensure_ascii=False)
+    logging.info(
+        f"{len(result['orphaned_objects'])} orphaned objects, {len(result['orphaned_media'])} orphaned media, "
+        f"{len(result['reparented_media'])} re-parented media (see {args.output}.json)"
+    )
+
+    if not args.delete and not args.reparent:
+        return
+    journal = SyncJournal(f"{args.output}.journal.jsonl", f"{args.output}.metrics.json")
+    limiter = RateLimiter(args.rate)
+    if args.reparent:
+        reparent_media(token, result["reparented_media"], dasch_media, dasch_objects, args.batch_size, limiter, journal)
+    excessive = excessive_orphans(result, dasch_objects, dasch_media, args.max_orphans)
+    if args.delete and excessive and not args.force:
+        logging.error(f"Not deleting: {', '.join(excessive)} are orphaned, more than {args.max_orphans}% (use --force to delete anyway)")
+    elif args.delete:
+        # media first, so no media is left pointing to a deleted object
+        delete_orphans(token, [dasch_media[identifier] for identifier in result["orphaned_media"]], "media", args.batch_size, limiter, journal)
+        delete_orphans(token, [dasch_objects[identifier] for identifier in result["orphaned_objects"]], "object", args.batch_size, limiter, journal)
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
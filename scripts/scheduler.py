@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+PRIORITIES = ("modified", "metadata-first", "small-media-first")
+
+
+def parse_priorities(value: str) -> list:
+    """Parses a comma-separated list of priorities, the first one weighs most."""
+    priorities = [priority.strip() for priority in value.split(",") if priority.strip()]
+    unknown = [priority for priority in priorities if priority not in PRIORITIES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown priority {', '.join(unknown)}, choose from {', '.join(PRIORITIES)}")
+    return priorities
+
+
+def splits_media(priorities: list) -> bool:
+    """Returns True if objects and media are scheduled separately."""
+    return "metadata-first" in priorities or "small-media-first" in priorities
+
+
+def modified_timestamp(resource: dict) -> float:
+    try:
+        return datetime.fromisoformat(resource["o:modified"]["@value"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def task_key(task: dict, priorities: list, pending: set) -> tuple:
+    """Sort key of a task: items left over by the last run first, then the given priorities."""
+    resource = task["media"] or task["item"]
+    key = [task["item"].get("o:id") not in pending]
+    for priority in priorities:
+        if priority == "modified":
+            key.append(-modified_timestamp(resource))
+        elif priority == "small-media-first" and task["media"]:
+            key.append(task["media"].get("o:size") or 0)
+    return tuple(key)
+
+
+def plan_tasks(tasks: list, priorities: list, pending: set) -> list:
+    """Orders the tasks into phases that run one after another.
+
+    Each task is a dict with 'kind' ('item' for an item with its media, 'object' or 'media'),
+    'item', 'media' (None unless kind is 'media') and 'item_set'. Media tasks need the resource
+    of their item, so when objects and media are scheduled separately all objects are synced
+    in a first phase. The sort is stable, so tasks of equal priority keep their given order.
+
+    Returns:
+        list: the phases, each a list of tasks
+    """
+    phases = [[task for task in tasks if task["kind"] != "media"], [task for task in tasks if task["kind"] == "media"]]
+    return [sorted(phase, key=lambda task: task_key(task, priorities, pending)) for phase in phases if phase]
+
+
+class Deadline:
+    """Time budget of a run; without a budget the deadline never passes."""
+
+    def __init__(self, budget: float | None) -> None:
+        self.end = time.monotonic() + budget if budget else None
+
+    def passed(self) -> bool:
+        return self.end is not None and time.monotonic() >= self.end
+
+
+def load_pending(path: str) -> list:
+    """Loads the tasks that were left over when the time budget of the last run ran out."""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as pending_file:
+        return json.load(pending_file)
+
+
+def save_pending(path: str, pending: list) -> None:
+    if not pending:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as pending_file:
+        json.dump(pending, pending_file, indent=4, ensure_ascii=False)
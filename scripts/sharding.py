@@ -0,0 +1,134 @@
+import argparse
+from argparse import Namespace
+import hashlib
+import json
+import logging
+
+from process_data_from_omeka import extract_property
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parses a shard specification of the form 'k/N' (1 <= k <= N).
+
+    Returns:
+        tuple[int, int]: the shard number k and the total number of shards N
+    """
+    try:
+        shard, total = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected the form k/N (e.g. 1/4)")
+    if total < 1 or not 1 <= shard <= total:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', k must be between 1 and N")
+    return shard, total
+
+
+def shard_of(omeka_id, total: int) -> int:
+    """Returns the shard (1..total) an Omeka item belongs to.
+
+    The shard is derived from a SHA-1 hash of the Omeka 'o:id', so the assignment
+    is identical on every machine and does not depend on the order of the items.
+    """
+    digest = hashlib.sha1(str(omeka_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % total + 1
+
+
+def shard_suffix(shard: int, total: int) -> str:
+    return f".shard-{shard}-of-{total}"
+
+
+def claim_identifiers(items: list) -> list:
+    """Returns the items that own their identifier.
+
+    An identifier is owned by the item with the lowest 'o:id' that carries it. Items
+    repeating an already claimed identifier are skipped, so no two items (in different
+    shards or item sets) can create a resource with the same identifier.
+    """
+    owners = {}
+    for item in sorted(items, key=lambda entry: entry.get("o:id", 0)):
+        item_id = extract_property(item.get("dcterms:identifier", []), 10)
+        if item_id in owners:
+            logging.warning(f"{item_id}: identifier is used by Omeka items {owners[item_id]} and {item.get('o:id')}, skipping item {item.get('o:id')}")
+            continue
+        owners[item_id] = item.get("o:id")
+
+    owner_ids = set(owners.values())
+    return [item for item in items if item.get("o:id") in owner_ids]
+
+
+def duplicate_media(media: list) -> set:
+    """Returns the Omeka IDs of the media that repeat an identifier of another media.
+
+    Media follow their parent item, so media of different items can end up in different
+    shards (or workers). As with items, the media with the lowest 'o:id' owns an identifier
+    and the others are skipped everywhere.
+    """
+    owners = {}
+    duplicates = set()
+    for entry in sorted(media, key=lambda entry: entry.get("o:id", 0)):
+        media_id = extract_property(entry.get("dcterms:identifier", []), 10)
+        if media_id in owners and owners[media_id] != entry.get("o:id"):
+            logging.warning(f"{media_id}: identifier is used by Omeka media {owners[media_id]} and {entry.get('o:id')}, skipping media {entry.get('o:id')}")
+            duplicates.add(entry.get("o:id"))
+            continue
+        owners[media_id] = entry.get("o:id")
+    return duplicates
+
+
+def merge_reports(metrics_paths: list, output_prefix: str) -> dict:
+    """Combines the metrics and journals of several shard runs into one report.
+
+    Writes '<output_prefix>.journal.jsonl' and '<output_prefix>.metrics.json'. Object and
+    media identifiers that were created more than once are listed under 'conflicts'.
+
+    Returns:
+        dict: the merged metrics
+    """
+    merged = {"shards": [], "items": 0, "duration_s": 0, "counts": {}, "conflicts": []}
+    created_by = {}
+    with open(f"{output_prefix}.journal.jsonl", "w", encoding="utf-8") as merged_journal:
+        for path in metrics_paths:
+            with open(path, encoding="utf-8") as metrics_file:
+                metrics = json.load(metrics_file)
+            merged["shards"].append(metrics.get("shard"))
+            merged["items"] += metrics.get("items", 0)
+            merged["duration_s"] = max(merged["duration_s"], metrics.get("duration_s", 0))
+            for kind, actions in metrics.get("counts", {}).items():
+                for action, number in actions.items():
+                    merged["counts"].setdefault(kind, {})
+                    merged["counts"][kind][action] = merged["counts"][kind].get(action, 0) + number
+
+            with open(metrics["journal"], encoding="utf-8") as journal:
+                for line in journal:
+                    entry = json.loads(line)
+                    entry["shard"] = metrics.get("shard")
+                    merged_journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    if entry["action"] == "created":
+                        created_by.setdefault((entry["kind"], entry["identifier"]), []).append(metrics.get("shard"))
+
+    merged["conflicts"] = [
+        {"kind": kind, "identifier": identifier, "shards": shards}
+        for (kind, identifier), shards in sorted(created_by.items()) if len(shards) > 1
+    ]
+    with open(f"{output_prefix}.metrics.json", "w", encoding="utf-8") as metrics_file:
+        json.dump(merged, metrics_file, indent=4)
+    return merged
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Merges the reports of sharded data_2_dasch runs")
+    parser.add_argument("metrics", nargs="+", help="metrics files of the shards (e.g. data_2_dasch.shard-*.metrics.json)")
+    parser.add_argument("-o", "--output", default="data_2_dasch.merged", help="prefix of the merged journal and metrics file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    merged = merge_reports(args.metrics, args.output)
+    logging.info(f"Merged {len(merged['shards'])} shard reports: {merged['counts']}")
+    for conflict in merged["conflicts"]:
+        logging.error(f"{conflict['identifier']}: {conflict['kind']} created more than once, by shards {conflict['shards']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import argparse
+from argparse import Namespace
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data_2_dasch import (
+    PREFIX,
+    DSP_USER,
+    DSP_PWD,
+    fetch_collection,
+    resolve_item_sets,
+    login,
+    get_project,
+    get_lists,
+    get_resources_of_class,
+    get_full_resources,
+    extract_dasch_propvalue,
+    extract_value_from_entry,
+    construct_payload,
+    specify_mediaclass,
+    update_value,
+)
+from event_log import setup_logging
+from data_model import load_data_model, register_list_iris, validate_changes
+from process_data_from_omeka import extract_property
+
+# Fields compared per resource class (the same fields as in check_values)
+OBJECT_FIELDS = ["title", "description", "subject", "temporal", "language", "isPartOf"]
+MEDIA_FIELDS = ["title", "description", "subject", "temporal", "language", "creator", "publisher", "date",
+                "extent", "type", "format", "source", "relation", "rights", "license"]
+MULTI_VALUE_FIELDS = ["subject", "isPartOf", "creator", "publisher", "source", "relation"]
+RESOURCE_CLASSES = ["sgb_OBJECT", "sgb_MEDIA_IMAGE", "sgb_MEDIA_DOCUMENT", "sgb_MEDIA_TEXT", "sgb_MEDIA_ARCHIV"]
+
+OMEKA_SCHEMA = pa.schema([
+    ("identifier", pa.string()),
+    ("omeka_id", pa.int64()),
+    ("resource_class", pa.string()),
+    ("field", pa.string()),
+    ("value_type", pa.string()),
+    ("value", pa.string()),
+    ("label", pa.string()),
+])
+DASCH_SCHEMA = pa.schema([
+    ("identifier", pa.string()),
+    ("iri", pa.string()),
+    ("resource_class", pa.string()),
+    ("field", pa.string()),
+    ("value_type", pa.string()),
+    ("value", pa.string()),
+    ("value_id", pa.string()),
+])
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Columnar snapshot of Omeka and DSP and field-level diff of both")
+    parser.add_argument("command", choices=["export", "audit", "sync"],
+                        help="'export' writes the snapshot, 'audit' reports the drift without writing to DSP, 'sync' applies the drift to DSP")
+    parser.add_argument("-d", "--dir", default="snapshot", help="directory of the snapshot files")
+    parser.add_argument("--reuse", action="store_true", help="diff an existing snapshot instead of exporting a new one")
+    parser.add_argument("--item-sets", type=str, default=None,
+                        help="comma-separated item set IDs or 'all' (all item sets of the site) that make up the collection (default: ITEM_SET_ID)")
+    parser.add_argument("--site-id", type=str, default=None, help="restricts '--item-sets all' to the item sets of this Omeka site")
+    return parser.parse_args()
+
+
+def resource_rows(resource: dict, fields: list) -> list:
+    """Normalizes the compared values of a DSP resource or payload into rows (one row per value).
+
+    A list value of a payload whose Omeka label could not be resolved (see list_value_entry) gives
+    a row with the value None and the label.
+    """
+    rows = []
+    for field in fields:
+        entries = resource.get(f"{PREFIX}{field}")
+        if isinstance(entries, dict):
+            entries = [entries]
+        for entry in entries or []:
+            value = extract_value_from_entry(entry)
+            label = None
+            if not value and entry["@type"] == "knora-api:ListValue":
+                label = entry.get("knora-api:listValueAsListNode", {}).get("rdfs:label")
+            if value or label:
+                rows.append({
+                    "field": field,
+                    "value_type": entry["@type"].removeprefix("knora-api:"),
+                    "value": value,
+                    "label": label,
+                    "value_id": entry.get("@id"),
+                })
+    return rows
+
+
+def fields_of_class(resource_class: str) -> list:
+    return OBJECT_FIELDS if resource_class == f"{PREFIX}sgb_OBJECT" else MEDIA_FIELDS
+
+
+def export_omeka(items: list, media: list, project_iri: str, lists: list) -> pa.Table:
+    """Builds the Omeka side of the snapshot from the same payloads construct_payload creates."""
+    columns = {name: [] for name in OMEKA_SCHEMA.names}
+    entries = [(item, f"{PREFIX}sgb_OBJECT") for item in items]
+    entries += [(entry, specify_mediaclass(extract_property(entry.get("dcterms:format", []), 9))) for entry in media]
+    for entry, resource_class in entries:
+        payload = construct_payload(entry, resource_class, project_iri, lists, "", "")
+        identifier = extract_dasch_propvalue(payload, "identifier")
+        for row in resource_rows(payload, fields_of_class(resource_class)):
+            columns["identifier"].append(identifier)
+            columns["omeka_id"].append(entry.get("o:id"))
+            columns["resource_class"].append(resource_class)
+            columns["field"].append(row["field"])
+            columns["value_type"].append(row["value_type"])
+            columns["value"].append(row["value"])
+            columns["label"].append(row["label"])
+    return pa.table(columns, schema=OMEKA_SCHEMA)
+
+
+def export_dasch(token: str) -> pa.Table:
+    """Builds the DSP side of the snapshot from all resources of the project classes."""
+    columns = {name: [] for name in DASCH_SCHEMA.names}
+    for resource_class in RESOURCE_CLASSES:
+        resource_iris = get_resources_of_class(token, f"{PREFIX}{resource_class}")
+        for resource in get_full_resources(token, list(resource_iris.values())):
+            identifier = extract_dasch_propvalue(resource, "identifier")
+            for row in resource_rows(resource, fields_of_class(resource["@type"])):
+                columns["identifier"].append(identifier)
+                columns["iri"].append(resource["@id"])
+                columns["resource_class"].append(resource["@type"])
+                for name in ("field", "value_type", "value", "value_id"):
+                    columns[name].append(row[name])
+    return pa.table(columns, schema=DASCH_SCHEMA)
+
+
+def diff_snapshots(omeka: pa.Table, dasch: pa.Table) -> tuple[pa.Table, pa.Array, pa.Array, pa.Table]:
+    """Computes the field-level changes for all resources present on both sides in one pass.
+
+    Values only on the Omeka side are creates, values only on the DSP side are deletes.
+    For single-value fields a create and a delete of the same field become an update.
+    Resources on only one side are not diffed but returned by identifier. Omeka labels that
+    could not be resolved to a list node are returned, and the fields they are in get no
+    deletes or updates, as check_values blocks them too.
+
+    Returns:
+        tuple[pa.Table, pa.Array, pa.Array, pa.Table]: the changes, the identifiers missing on DSP,
+                                                       the identifiers only on DSP and the unresolved labels
+    """
+    unresolved = omeka.filter(pc.is_null(omeka["value"])).select(["identifier", "field", "label"])
+    omeka = omeka.filter(pc.is_valid(omeka["value"]))
+    omeka_ids = pc.unique(omeka["identifier"])
+    dasch_ids = pc.unique(dasch["identifier"])
+    missing_on_dasch = omeka_ids.filter(pc.invert(pc.is_in(omeka_ids, value_set=dasch_ids)))
+    only_on_dasch = dasch_ids.filter(pc.invert(pc.is_in(dasch_ids, value_set=omeka_ids)))
+    omeka = omeka.filter(pc.is_in(omeka["identifier"], value_set=dasch_ids))
+    dasch = dasch.filter(pc.is_in(dasch["identifier"], value_set=omeka_ids))
+
+    keys = ["identifier", "field", "value"]
+    creates = omeka.join(dasch.select(keys), keys=keys, join_type="left anti")
+    deletes = dasch.join(omeka.select(keys), keys=keys, join_type="left anti")
+
+    multi_value_fields = pa.array(MULTI_VALUE_FIELDS)
+    single_creates = creates.filter(pc.invert(pc.is_in(creates["field"], value_set=multi_value_fields)))
+    single_deletes = deletes.filter(pc.invert(pc.is_in(deletes["field"], value_set=multi_value_fields)))
+    updates = single_creates.join(single_deletes.select(["identifier", "field", "value_id"]),
+                                  keys=["identifier", "field"], join_type="inner")
+    updated_fields = updates.select(["identifier", "field"])
+    creates = creates.join(updated_fields, keys=["identifier", "field"], join_type="left anti")
+    deletes = deletes.join(updated_fields, keys=["identifier", "field"], join_type="left anti")
+    blocked_fields = unresolved.select(["identifier", "field"])
+    updates = updates.join(blocked_fields, keys=["identifier", "field"], join_type="left anti")
+    deletes = deletes.join(blocked_fields, keys=["identifier", "field"], join_type="left anti")
+
+    columns = ["change_type", "identifier", "resource_class", "field", "value_type", "value", "value_id"]
+    changes = []
+    for change_type, table in (("create", creates), ("update", updates), ("delete", deletes)):
+        if "value_id" not in table.column_names:
+            table = table.append_column("value_id", pa.nulls(table.num_rows, pa.string()))
+        table = table.append_column("change_type", pa.array([change_type] * table.num_rows, pa.string()))
+        changes.append(table.select(columns))
+    return pa.concat_tables(changes), missing_on_dasch, only_on_dasch, unresolved
+
+
+def report_drift(changes: pa.Table, missing_on_dasch: pa.Array, only_on_dasch: pa.Array, unresolved: pa.Table) -> None:
+    for row in unresolved.to_pylist():
+        logging.error(f"{row['identifier']}: {row['field']}: '{row['label']}' is not a node of the list, field left unchanged")
+    summary = changes.group_by(["change_type", "field"]).aggregate([("identifier", "count")])
+    for row in summary.sort_by([("change_type", "ascending"), ("field", "ascending")]).to_pylist():
+        logging.info(f"{row['change_type']} {row['field']}: {row['identifier_count']} values")
+    drifted = len(pc.unique(changes["identifier"]))
+    logging.info(f"{changes.num_rows} value changes in {drifted} resources, {len(missing_on_dasch)} resources missing on DSP, "
+                 f"{len(only_on_dasch)} resources only on DSP")
+
+
+def current_changes(resource: dict, changes: list) -> list:
+    """Leaves out the changes of a reused snapshot that no longer match the freshly fetched resource.
+
+    A create of a value the resource already has, a delete of a value it no longer has and an
+    update of a field that is empty or already up to date are stale.
+    """
+    current = {}
+    for row in resource_rows(resource, sorted({change["field"] for change in changes})):
+        current.setdefault(row["field"], set()).add(row["value"])
+    identifier = extract_dasch_propvalue(resource, "identifier")
+    fresh = []
+    for change in changes:
+        values = current.get(change["field"], set())
+        if change["type"] == "create":
+            stale = change["value"] in values
+        elif change["type"] == "delete":
+            stale = change["value"] not in values
+        else:
+            stale = not values or change["value"] in values
+        if stale:
+            logging.warning(f"{identifier}: {change['type']} of {change['field']} does not match DSP anymore, skipped (export a new snapshot)")
+            continue
+        fresh.append(change)
+    return fresh
+
+
+def apply_changes(token: str, changes: pa.Table, dasch: pa.Table, data_model: dict) -> None:
+    """Applies the changes with update_value, fetching only the resources that drifted.
+
+    The changes are checked against the fetched resources (see current_changes), so a reused
+    snapshot cannot write stale values. The changes of a resource are only applied if all of
+    them pass the local validation.
+    """
+    resources = dasch.group_by(["identifier", "iri"]).aggregate([])
+    changed = resources.filter(pc.is_in(resources["identifier"], value_set=pc.unique(changes["identifier"])))
+    changes_by_identifier = {}
+    for change in changes.to_pylist():
+        changes_by_identifier.setdefault(change["identifier"], []).append({
+            "field": change["field"],
+            "prop_type": change["value_type"],
+            "type": change["change_type"],
+            "value": change["value"],
+        })
+    for resource in get_full_resources(token, changed["iri"].to_pylist()):
+        identifier = extract_dasch_propvalue(resource, "identifier")
+        resource_changes = current_changes(resource, changes_by_identifier.get(identifier, []))
+        violations = validate_changes(data_model, resource, resource_changes, PREFIX)
+        if violations:
+            for violation in violations:
+                logging.error(f"{identifier}: {violation}")
+            continue
+        for change in resource_changes:
+            update_value(token, resource, change["value"], change["field"], change["prop_type"], change["type"])
+
+
+def main() -> None:
+    args = parse_arguments()
+    setup_logging("data_2_dasch.snapshot")
+    snapshot_dir = Path(args.dir)
+    omeka_path = snapshot_dir / "omeka.parquet"
+    dasch_path = snapshot_dir / "dasch.parquet"
+
+    if not args.reuse or args.command == "sync":
+        token = login(DSP_USER, DSP_PWD)
+        project_iri = get_project()
+        project_lists = get_lists(project_iri)
+    if args.reuse:
+        omeka = pq.read_table(omeka_path)
+        dasch = pq.read_table(dasch_path)
+    else:
+        items, media = fetch_collection(resolve_item_sets(args.item_sets, args.site_id))
+        omeka = export_omeka(items, media, project_iri, project_lists)
+        dasch = export_dasch(token)
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        pq.write_table(omeka, omeka_path)
+        pq.write_table(dasch, dasch_path)
+        logging.info(f"Snapshot written to {snapshot_dir}: {omeka.num_rows} Omeka values, {dasch.num_rows} DSP values")
+    if args.command == "export":
+        return
+
+    changes, missing_on_dasch, only_on_dasch, unresolved = diff_snapshots(omeka, dasch)
+    pq.write_table(changes, snapshot_dir / "diff.parquet")
+    report_drift(changes, missing_on_dasch, only_on_dasch, unresolved)
+    if args.command == "sync":
+        data_model = load_data_model()
+        register_list_iris(data_model, project_lists)
+        apply_changes(token, changes, dasch, data_model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class SyncJournal:
+    """Records the outcome of every processed object and media resource of a run.
+
+    Each outcome is appended as one JSON line to the journal file. The counts per
+    kind ('object', 'media') and action ('created', 'updated', 'unchanged', 'failed')
+    are kept in memory and written to the metrics file when the journal is closed.
+    """
+
+    def __init__(self, journal_path: str, metrics_path: str, **run_info) -> None:
+        self.journal_path = journal_path
+        self.metrics_path = metrics_path
+        self.run_info = run_info
+        self.counts = Counter()
+        self.started = datetime.now(timezone.utc)
+        self._start_clock = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(journal_path, "w", encoding="utf-8")
+
+    def record(self, kind: str, identifier: str, action: str, omeka_id=None, **extra) -> None:
+        entry = {"kind": kind, "identifier": identifier, "action": action, "omeka_id": omeka_id, **extra}
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.counts[(kind, action)] += 1
+
+    def metrics(self) -> dict:
+        counts = {}
+        for (kind, action), number in sorted(self.counts.items()):
+            counts.setdefault(kind, {})[action] = number
+        return {
+            **self.run_info,
+            "journal": self.journal_path,
+            "started": self.started.isoformat(),
+            "finished": datetime.now(timezone.utc).isoformat(),
+            "duration_s": round(time.monotonic() - self._start_clock, 3),
+            "counts": counts,
+        }
+
+    def write_metrics(self) -> None:
+        with open(self.metrics_path, "w", encoding="utf-8") as metrics_file:
+            json.dump(self.metrics(), metrics_file, indent=4)
+
+    def close(self) -> None:
+        self._file.close()
+        self.write_metrics()
@@ -0,0 +1,203 @@
+import argparse
+from argparse import Namespace
+import logging
+from pathlib import Path
+import re
+import urllib
+import xml.etree.ElementTree as ET
+import zipfile
+
+from data_2_dasch import (
+    PREFIX,
+    construct_payload,
+    extract_value_from_entry,
+    fetch_collection,
+    resolve_item_sets,
+    specify_mediaclass,
+)
+from event_log import setup_logging
+from data_model import load_data_model, lists_from_data_model, validate_payload
+from process_data_from_omeka import download_file, extract_property
+
+XML_NAMESPACE = "https://dasch.swiss/schema"
+XSD_LOCATION = "https://raw.githubusercontent.com/dasch-swiss/dsp-tools/main/src/dsp_tools/resources/schema/data.xsd"
+XML_ID_PATTERN = re.compile(r"^[A-Za-z_][\w.-]*$")
+
+# Property elements of the DSP-TOOLS XML format per value type
+PROPERTY_ELEMENTS = {
+    "knora-api:TextValue": ("text-prop", "text"),
+    "knora-api:ListValue": ("list-prop", "list"),
+    "knora-api:UriValue": ("uri-prop", "uri"),
+    "knora-api:LinkValue": ("resptr-prop", "resptr"),
+}
+
+
+def parse_arguments() -> Namespace:
+    parser = argparse.ArgumentParser(description="Exports the Omeka collection as DSP-TOOLS XML for xmlupload")
+    parser.add_argument("-o", "--output", default="data_2_dasch.xml", help="path of the XML file")
+    parser.add_argument("--media-dir", default="media", help="directory of the staged media files referenced by the bitstreams")
+    parser.add_argument("--stage", action="store_true", help="download the media originals into the media directory")
+    parser.add_argument("--item-sets", type=str, default=None,
+                        help="comma-separated item set IDs or 'all' (all item sets of the site) that make up the collection (default: ITEM_SET_ID)")
+    parser.add_argument("--site-id", type=str, default=None, help="restricts '--item-sets all' to the item sets of this Omeka site")
+    return parser.parse_args()
+
+
+def staged_filename(media: dict, media_class: str) -> str:
+    """Returns the filename of a staged media file; files of the archive class are zipped."""
+    original_filename = Path(urllib.parse.urlparse(media.get("o:original_url", "")).path).name
+    if media_class == f"{PREFIX}sgb_MEDIA_ARCHIV":
+        return f"{Path(original_filename).stem}.zip"
+    return original_filename
+
+
+def stage_media(media: dict, media_class: str, media_dir: Path) -> bool:
+    """Downloads the original of a media into the media directory; files of the archive class are zipped.
+
+    The download is verified against the Omeka checksum ('o:sha256') before it is staged, so an
+    existing staged file was verified by an earlier run and is kept.
+
+    Returns:
+        bool: False if the download does not match the Omeka checksum
+    """
+    target = media_dir / staged_filename(media, media_class)
+    if target.exists():
+        return True
+    original_url = media.get("o:original_url", "")
+    original_filename = Path(urllib.parse.urlparse(original_url).path).name
+    download_path = media_dir / f"{original_filename}.part"
+    sha256 = download_file(original_url, str(download_path))
+    if media.get("o:sha256") and sha256 != media["o:sha256"]:
+        logging.error(f"{original_filename}: checksum {sha256} does not match the Omeka checksum {media['o:sha256']}")
+        download_path.unlink()
+        return False
+    if media_class != f"{PREFIX}sgb_MEDIA_ARCHIV":
+        download_path.rename(target)
+        return True
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(download_path, arcname=original_filename)
+    download_path.unlink()
+    return True
+
+
+def resource_element(payload: dict, xml_id: str, model: dict) -> ET.Element:
+    """Converts a payload built by construct_payload into a DSP-TOOLS <resource> element."""
+    resource = ET.Element("resource", {
+        "label": payload["rdfs:label"],
+        "restype": f":{payload['@type'].removeprefix(PREFIX)}",
+        "id": xml_id,
+        "permissions": "res-default",
+    })
+    for key, entry in payload.items():
+        if key.startswith("knora-api:has") and key.endswith("FileValue"):
+            bitstream = ET.SubElement(resource, "bitstream", {"permissions": "prop-default"})
+            bitstream.text = entry["knora-api:fileValueHasFilename"]
+
+    for key, entries in payload.items():
+        if not key.startswith(PREFIX):
+            continue
+        if isinstance(entries, dict):
+            entries = [entries]
+        entries = [entry for entry in entries if extract_value_from_entry(entry)]
+        if not entries:
+            continue
+        prop_element, value_element = PROPERTY_ELEMENTS[entries[0]["@type"]]
+        prop = key.removeprefix(PREFIX).removesuffix("Value") if value_element == "resptr" else key.removeprefix(PREFIX)
+        attributes = {"name": f":{prop}"}
+        if value_element == "list":
+            attributes["list"] = model["properties"][prop]["list"]
+        element = ET.SubElement(resource, prop_element, attributes)
+        for entry in entries:
+            value_attributes = {"permissions": "prop-default"}
+            if value_element == "text":
+                value_attributes["encoding"] = "utf8"
+            value = ET.SubElement(element, value_element, value_attributes)
+            value.text = extract_value_from_entry(entry).strip() if value_element == "uri" else extract_value_from_entry(entry)
+    return resource
+
+
+def permissions_element(permission_id: str) -> ET.Element:
+    permissions = ET.Element("permissions", {"id": permission_id})
+    for group, right in (("UnknownUser", "V"), ("KnownUser", "V"), ("ProjectMember", "D"), ("ProjectAdmin", "CR")):
+        allow = ET.SubElement(permissions, "allow", {"group": group})
+        allow.text = right
+    return permissions
+
+
+def build_xml(items: list, media: list, model: dict, media_dir: Path) -> tuple[ET.ElementTree, list]:
+    """Builds the DSP-TOOLS XML document for the items and media of a collection.
+
+    Objects and media are linked by their Omeka identifiers, which are used as XML ids. A media
+    whose object is left out is left out too, as its link would point to a missing XML id.
+
+    Returns:
+        tuple[ET.ElementTree, list]: the document and the violations of resources that were left out
+    """
+    lists = lists_from_data_model(model)
+    root = ET.Element("knora", {
+        "xmlns": XML_NAMESPACE,
+        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+        "xsi:schemaLocation": f"{XML_NAMESPACE} {XSD_LOCATION}",
+        "shortcode": model["shortcode"],
+        "default-ontology": model["ontology"],
+    })
+    root.append(permissions_element("res-default"))
+    root.append(permissions_element("prop-default"))
+
+    parent_ids = {item.get("o:id"): extract_property(item.get("dcterms:identifier", []), 10) for item in items}
+    entries = [(item, f"{PREFIX}sgb_OBJECT", "", "") for item in items]
+    for entry in media:
+        media_class = specify_mediaclass(extract_property(entry.get("dcterms:format", []), 9))
+        parent_id = parent_ids.get(entry.get("o:item", {}).get("o:id"), "")
+        entries.append((entry, media_class, parent_id, str(media_dir / staged_filename(entry, media_class))))
+
+    violations = []
+    xml_ids = set()
+    for entry, resource_class, parent_id, bitstream in entries:
+        payload = construct_payload(entry, resource_class, "", lists, parent_id, bitstream)
+        xml_id = extract_property(entry.get("dcterms:identifier", []), 10)
+        problems = validate_payload(model, payload, PREFIX)
+        if not XML_ID_PATTERN.match(xml_id):
+            problems.append(f"identifier '{xml_id}' is not a valid XML id")
+        if xml_id in xml_ids:
+            problems.append(f"identifier '{xml_id}' is used more than once")
+        if resource_class != f"{PREFIX}sgb_OBJECT" and not parent_id:
+            problems.append("parent object is not in the collection")
+        elif resource_class != f"{PREFIX}sgb_OBJECT" and parent_id not in xml_ids:
+            problems.append(f"parent object '{parent_id}' is not exported")
+        if problems:
+            violations.extend(f"{xml_id or entry.get('o:id')}: {problem}" for problem in problems)
+            continue
+        xml_ids.add(xml_id)
+        root.append(resource_element(payload, xml_id, model))
+
+    tree = ET.ElementTree(root)
+    ET.indent(tree)
+    return tree, violations
+
+
+def main() -> None:
+    args = parse_arguments()
+    setup_logging("data_2_dasch.xml_export")
+    media_dir = Path(args.media_dir)
+    model = load_data_model()
+
+    items, media = fetch_collection(resolve_item_sets(args.item_sets, args.site_id))
+    if args.stage:
+        media_dir.mkdir(parents=True, exist_ok=True)
+        mismatched = [
+            entry for entry in media
+            if not stage_media(entry, specify_mediaclass(extract_property(entry.get("dcterms:format", []), 9)), media_dir)
+        ]
+        if mismatched:
+            logging.warning(f"{len(mismatched)} media files were not staged because their checksum does not match")
+
+    tree, violations = build_xml(items, media, model, media_dir)
+    for violation in violations:
+        logging.error(violation)
+    tree.write(args.output, encoding="utf-8", xml_declaration=True)
+    logging.info(f"Exported {len(tree.getroot().findall('resource'))} resources to {args.output}, {len(violations)} violations")
+
+
+if __name__ == "__main__":
+    main()